@@ -1,8 +1,10 @@
 # infra_routes.py
 import json
+import math
 import time
 import uuid
-from typing import Dict, Optional, Tuple, Any
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple, Any
 
 import json
 import time
@@ -27,11 +29,34 @@ from fastapi import (
     Depends,
     Header,
     Form,
+    Request,
 )
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, EmailStr
-from openai import OpenAI
+
+from app.services.context_budget import compact_messages
+from app.services.gpu_pool import (
+    idle_count,
+    mark_busy,
+    mark_idle,
+    match_idle,
+    parse_capabilities,
+    pool_stats,
+    register_worker,
+    remove_worker,
+    task_requirements,
+)
+from app.services.llm import LLMConfigError, achat, get_async_client, hedge_stats, llm_metrics
+from app.services.predispatch import (
+    PREDISPATCH_GRACE_S,
+    cancel_enrichment,
+    enrichment_done,
+    finish_enrichment,
+    start_enrichment,
+    wait_enrichment,
+)
+from app.services.sse import SSE_HEADERS, stream_chat_sse
 
 # =========================================================
 # APP / ROUTER
@@ -209,13 +234,11 @@ async def login(req: LoginReq):
 
 
 @router.post("/chat")
-async def ccioi_chat(req: DeepSeekChatReq):
-    api_key = os.getenv("CCIOI_API_KEY")
-    if not api_key:
-        raise HTTPException(status_code=500, detail="CCIOI_API_KEY is missing")
-
-    base_url = os.getenv("CCIOI_BASE_URL", "https://api.deepseek.com")
-    client = OpenAI(api_key=api_key, base_url=base_url)
+async def ccioi_chat(req: DeepSeekChatReq, request: Request):
+    try:
+        get_async_client("deepseek")
+    except LLMConfigError as exc:
+        raise HTTPException(status_code=500, detail=str(exc))
     model = req.model or "deepseek-chat"
 
     system_guardrail = (
@@ -223,40 +246,36 @@ async def ccioi_chat(req: DeepSeekChatReq):
         "identity, training data, or provider details. If asked, say you are "
         "a CCIOI assistant and cannot disclose internal implementation details."
     )
-    messages = [{"role": "system", "content": system_guardrail}] + req.messages
+    messages = [{"role": "system", "content": system_guardrail}] + compact_messages(req.messages)
 
     if req.stream:
-        def stream_generator():
-            try:
-                response = client.chat.completions.create(
+        return StreamingResponse(
+            stream_chat_sse(
+                request,
+                lambda: achat(
+                    "deepseek",
                     model=model,
                     messages=messages,
                     stream=True,
-                )
-                for chunk in response:
-                    delta = chunk.choices[0].delta
-                    content = getattr(delta, "content", None)
-                    if content:
-                        yield f"data: {content}\n\n"
-            except Exception as exc:
-                yield f"data: [ERROR] {exc}\n\n"
-
-        return StreamingResponse(
-            stream_generator(),
+                ),
+            ),
             media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-            },
+            headers=SSE_HEADERS,
         )
 
-    response = client.chat.completions.create(
+    response = await achat(
+        "deepseek",
         model=model,
         messages=messages,
         stream=False,
     )
     return {"content": response.choices[0].message.content}
 
+
+@router.get("/llm/metrics")
+def get_llm_metrics():
+    return {"models": llm_metrics(), "hedging": hedge_stats()}
+
 # =========================================================
 # UPLOAD API (Frontend -> Server -> OSS)
 # =========================================================
@@ -372,11 +391,416 @@ def build_torchrun_command(payload: dict,taskid: str) -> str:
         cmd.extend(["--cond_type", p.get("cond") or "i2v_head", "--ref", p["ref_image"]])
     return " ".join(cmd)
 
-def select_idle_gpu() -> Tuple[Optional[str], Optional[dict]]:
-    for gpu_id, info in gpu_registry.items():
-        if info["status"] == "idle":
-            return gpu_id, info
-    return None, None
+def validate_task_parameters(parameters: dict, task_id: str) -> Optional[str]:
+    """
+    Dry-run build_torchrun_command before the task touches the queue or a GPU;
+    returns an error message for the frontend, or None.
+    """
+    try:
+        # motion_score 可能是 "auto"，派发前才确定
+        probe = {**parameters, "motion_score": parameters.get("motion_score") or 0}
+        build_torchrun_command({"parameters": probe}, task_id)
+    except KeyError as e:
+        return f"Missing task parameter: {e.args[0]}"
+    except Exception as e:
+        return f"Invalid task parameters: {e}"
+    # GPU 匹配时会对这些字段做 int()，非法值要在入队前拒绝
+    try:
+        for field in ("steps", "frames", "fps"):
+            int(parameters[field])
+        task_requirements(parameters)
+    except (TypeError, ValueError):
+        return "Invalid task parameters: steps, frames, fps and min_vram_gb must be integers"
+    return None
+
+def select_idle_gpu(parameters: Optional[dict] = None) -> Tuple[Optional[str], Optional[dict]]:
+    # 按能力分桶的空闲池，优先匹配刚好够用的 GPU
+    gpu_id = match_idle(parameters)
+    if gpu_id is None:
+        return None, None
+    return gpu_id, gpu_registry[gpu_id]
+
+def set_gpu_status(gpu_id: str, gpu: dict, status: str, task_id: Optional[str] = None) -> None:
+    gpu["status"] = status
+    gpu["current_task"] = task_id
+    if gpu_registry.get(gpu_id) is gpu:
+        if status == "idle":
+            mark_idle(gpu_id)
+        else:
+            mark_busy(gpu_id)
+
+def _unregister_gpu(gpu_id: str, ws: WebSocket) -> Optional[dict]:
+    # 同一个 gpu_id 可能已经用新连接重新注册
+    info = gpu_registry.get(gpu_id)
+    if info is None or info["ws"] is not ws:
+        return None
+    gpu_registry.pop(gpu_id, None)
+    remove_worker(gpu_id)
+    return info
+
+# =========================================================
+# Dispatch queue
+# =========================================================
+GPU_QUEUE_MAX = int(os.getenv("GPU_QUEUE_MAX", "200"))
+GPU_QUEUE_UPDATE_INTERVAL_S = float(os.getenv("GPU_QUEUE_UPDATE_INTERVAL", "5"))
+
+# FIFO of {task_id, ws, data, user_id, parameters, enrichment, enqueued_at, queued}
+task_queue: Deque[dict] = deque()
+_dispatch_lock = asyncio.Lock()
+_queue_ticker: Optional[asyncio.Task] = None
+# EWMA of dispatch -> task_finished, for wait estimates
+_task_duration_s: Optional[float] = None
+
+
+def _estimated_wait_s(position: int) -> Optional[float]:
+    if _task_duration_s is None:
+        return None
+    gpus = max(len(gpu_registry), 1)
+    return round(_task_duration_s * math.ceil(position / gpus), 1)
+
+
+async def _send_queue_update(entry: dict, position: int) -> None:
+    try:
+        await entry["ws"].send_text(
+            json.dumps(
+                {
+                    "type": "TASK_QUEUED",
+                    "task_id": entry["task_id"],
+                    "position": position,
+                    "queue_length": len(task_queue),
+                    "waited_s": round(time.time() - entry["enqueued_at"], 1),
+                    "estimated_wait_s": _estimated_wait_s(position),
+                }
+            )
+        )
+    except Exception:
+        pass
+
+
+async def _push_queue_updates() -> None:
+    for position, entry in enumerate(list(task_queue), start=1):
+        await _send_queue_update(entry, position)
+
+
+async def _queue_ticker_loop() -> None:
+    while task_queue:
+        await asyncio.sleep(GPU_QUEUE_UPDATE_INTERVAL_S)
+        await _push_queue_updates()
+
+
+def _ensure_queue_ticker() -> None:
+    global _queue_ticker
+    if _queue_ticker is None or _queue_ticker.done():
+        _queue_ticker = asyncio.ensure_future(_queue_ticker_loop())
+
+
+def _drop_queued_tasks(ws: WebSocket) -> None:
+    # 前端断开：撤掉它还在排队的任务
+    for entry in [e for e in task_queue if e["ws"] is ws]:
+        task_queue.remove(entry)
+        cancel_enrichment(entry["enrichment"])
+        task_frontend_map.pop(entry["task_id"], None)
+        task_ctx_map.pop(entry["task_id"], None)
+
+
+def _ready_for_dispatch(entry: dict) -> bool:
+    # 预处理没做完且宽限期未到的任务先不占 GPU
+    if enrichment_done(entry["enrichment"]):
+        return True
+    return time.time() >= entry["enqueued_at"] + PREDISPATCH_GRACE_S
+
+
+async def schedule_tasks() -> None:
+    """
+    Hand queued tasks to idle GPUs, oldest first. A task no idle GPU can run,
+    or still waiting for its enrichment, does not hold back the ones behind
+    it. Called on submit, enrichment completion, task_finished and GPU
+    registration.
+    """
+    dispatched = False
+    async with _dispatch_lock:
+        for entry in list(task_queue):
+            if not idle_count():
+                break
+            if not _ready_for_dispatch(entry):
+                continue
+            gpu_id, gpu = select_idle_gpu(entry["parameters"])
+            if not gpu:
+                continue
+            task_queue.remove(entry)
+            set_gpu_status(gpu_id, gpu, "busy", entry["task_id"])
+            task_gpu_map[entry["task_id"]] = gpu_id
+            asyncio.ensure_future(_dispatch(entry, gpu_id, gpu))
+            dispatched = True
+    if dispatched and task_queue:
+        await _push_queue_updates()
+
+
+async def _schedule_when_enriched(state: Optional[dict]) -> None:
+    # 预处理完成（或宽限期到）后重新调度，等待中的任务不占 GPU
+    await wait_enrichment(state, PREDISPATCH_GRACE_S)
+    await schedule_tasks()
+
+
+async def enqueue_task(ws: WebSocket, data: dict, user_id: Optional[str], task_id: str, parameters: dict) -> dict:
+    """
+    Queue a validated task and start its enrichment; it is dispatched once
+    the enrichment finishes (or PREDISPATCH_GRACE_S passes) and a GPU is idle.
+    """
+    enrichment = start_enrichment(parameters)
+    entry = {
+        "task_id": task_id,
+        "ws": ws,
+        "data": data,
+        "user_id": user_id,
+        "parameters": parameters,
+        "enrichment": enrichment,
+        "enqueued_at": time.time(),
+        "queued": bool(task_queue) or select_idle_gpu(parameters)[1] is None,
+    }
+
+    # 保存 task 上下文（保证 GPU 回来时一定能补齐 user_id/prompt）
+    task_ctx_map[task_id] = {
+        "user_id": user_id,
+        "prompt": parameters.get("prompt"),
+        "created_at": time.time(),
+    }
+    task_frontend_map[task_id] = ws
+    task_queue.append(entry)
+
+    if entry["queued"]:
+        await _send_queue_update(entry, len(task_queue))
+        _ensure_queue_ticker()
+    if enrichment is not None:
+        asyncio.ensure_future(_schedule_when_enriched(enrichment))
+    await schedule_tasks()
+    return entry
+
+
+async def _requeue_front(entry: dict) -> None:
+    if any(e is entry for e in task_queue):
+        return
+    entry["queued"] = True
+    task_gpu_map.pop(entry["task_id"], None)
+    ctx = task_ctx_map.get(entry["task_id"])
+    if ctx is not None:
+        ctx.pop("entry", None)
+    task_queue.appendleft(entry)
+    await schedule_tasks()
+
+
+async def _dispatch(entry: dict, gpu_id: str, gpu: dict) -> None:
+    # 派发任务是 fire-and-forget 的：任何异常都要释放 GPU 并通知前端
+    task_id = entry["task_id"]
+    try:
+        await _dispatch_task(entry, gpu_id, gpu)
+    except Exception as e:
+        print(f"🔥 Dispatch of task {task_id} failed: {e}")
+        if gpu.get("current_task") == task_id:
+            set_gpu_status(gpu_id, gpu, "idle")
+        task_gpu_map.pop(task_id, None)
+        task_ctx_map.pop(task_id, None)
+        task_frontend_map.pop(task_id, None)
+        try:
+            await entry["ws"].send_text(
+                json.dumps({"type": "TASK_REJECTED", "task_id": task_id, "message": f"Dispatch failed: {e}"})
+            )
+        except Exception:
+            pass
+        await schedule_tasks()
+
+
+async def _dispatch_task(entry: dict, gpu_id: str, gpu: dict) -> None:
+    task_id = entry["task_id"]
+    ws = entry["ws"]
+
+    # 到这里预处理已完成或宽限期已过：不再等待，没做完的步骤用原始输入
+    parameters, predispatch = await finish_enrichment(entry["enrichment"], entry["parameters"], 0.0)
+    entry["parameters"], entry["enrichment"] = parameters, None
+
+    if gpu_registry.get(gpu_id) is not gpu:
+        # GPU 在等待期间断开
+        await _requeue_front(entry)
+        return
+
+    command = build_torchrun_command({**entry["data"], "parameters": parameters}, task_id)
+
+    print(f"📤 Dispatch task {task_id} to GPU {gpu_id}")
+    print("🧠 Torchrun command:")
+    print(command)
+
+    # 发给 GPU：把 user_id/prompt 也带上（这会让 gpu_client 直接回传，不依赖补齐）
+    try:
+        await gpu["ws"].send_text(
+            json.dumps(
+                {
+                    "type": "exec_command",
+                    "task_id": task_id,
+                    "command": command,
+                    "user_id": entry["user_id"],
+                    "prompt": (entry["data"].get("parameters") or {}).get("prompt"),
+                }
+            )
+        )
+    except Exception as e:
+        print(f"🔥 Dispatch to GPU {gpu_id} failed: {e}")
+        set_gpu_status(gpu_id, gpu, "idle")
+        await _requeue_front(entry)
+        return
+
+    # 下发成功后才记上下文：之后 GPU 丢失由 _recover_task 接管
+    ctx = task_ctx_map.get(task_id)
+    if ctx is not None:
+        ctx["predispatch"] = predispatch
+        ctx["dispatched_at"] = time.time()
+        ctx["gpu_id"] = gpu_id
+        ctx["entry"] = entry
+
+    # Ack 前端
+    try:
+        await ws.send_text(
+            json.dumps(
+                {
+                    "type": "TASK_ACCEPTED",
+                    "task_id": task_id,
+                    "gpu_id": gpu_id,
+                    "waited_s": round(time.time() - entry["enqueued_at"], 1),
+                    "predispatch": predispatch,
+                }
+            )
+        )
+    except Exception:
+        pass
+
+
+# =========================================================
+# Stale GPU reaper
+# =========================================================
+GPU_HEARTBEAT_TIMEOUT_S = float(os.getenv("GPU_HEARTBEAT_TIMEOUT", "45"))
+# Detection latency is at most timeout + interval.
+GPU_REAPER_INTERVAL_S = float(os.getenv("GPU_REAPER_INTERVAL", str(min(GPU_HEARTBEAT_TIMEOUT_S / 3, 5.0))))
+GPU_TASK_MAX_REQUEUES = int(os.getenv("GPU_TASK_MAX_REQUEUES", "1"))
+
+_reaper_task: Optional[asyncio.Task] = None
+_reaper_stats = {
+    "reaped": 0,
+    "disconnected_busy": 0,
+    "tasks_requeued": 0,
+    "tasks_failed": 0,
+    "silence_s_total": 0.0,
+    "last_reap_at": None,
+}
+
+
+async def _recover_task(task_id: Optional[str], gpu_id: str, reason: str) -> None:
+    """
+    In-flight task of a lost GPU: back to the head of the queue, or failed
+    once it has been requeued GPU_TASK_MAX_REQUEUES times.
+    """
+    if not task_id:
+        return
+    task_gpu_map.pop(task_id, None)
+    ctx = task_ctx_map.get(task_id) or {}
+    entry = ctx.get("entry")
+    if entry is None:
+        # Not sent to the GPU yet; _dispatch notices the lost GPU itself.
+        return
+    frontend_ws = task_frontend_map.get(task_id)
+
+    if entry.get("requeues", 0) < GPU_TASK_MAX_REQUEUES and entry["ws"] is frontend_ws:
+        entry["requeues"] = entry.get("requeues", 0) + 1
+        _reaper_stats["tasks_requeued"] += 1
+        print(f"♻️ Requeue task {task_id} from lost GPU {gpu_id} ({reason})")
+        if frontend_ws:
+            try:
+                await frontend_ws.send_text(
+                    json.dumps({"type": "TASK_LOG", "stream": "stderr", "line": f"GPU lost ({reason}), task requeued"})
+                )
+            except Exception:
+                pass
+        await _requeue_front(entry)
+        for position, queued in enumerate(task_queue, start=1):
+            if queued is entry:
+                await _send_queue_update(entry, position)
+                _ensure_queue_ticker()
+                break
+        return
+
+    _reaper_stats["tasks_failed"] += 1
+    print(f"💀 Task {task_id} failed: GPU {gpu_id} lost ({reason})")
+    task_ctx_map.pop(task_id, None)
+    task_frontend_map.pop(task_id, None)
+    if frontend_ws:
+        try:
+            await frontend_ws.send_text(
+                json.dumps(
+                    {
+                        "type": "task_finished",
+                        "task_id": task_id,
+                        "status": "failed",
+                        "error": f"GPU lost ({reason})",
+                        "user_id": ctx.get("user_id"),
+                        "prompt": ctx.get("prompt"),
+                    }
+                )
+            )
+        except Exception:
+            pass
+
+
+async def reap_stale_gpus() -> int:
+    now = time.time()
+    reaped = 0
+    for gpu_id, info in list(gpu_registry.items()):
+        silence = now - info["last_heartbeat"]
+        if silence <= GPU_HEARTBEAT_TIMEOUT_S:
+            continue
+        if _unregister_gpu(gpu_id, info["ws"]) is None:
+            continue
+        reaped += 1
+        _reaper_stats["reaped"] += 1
+        _reaper_stats["silence_s_total"] += silence
+        _reaper_stats["last_reap_at"] = now
+        print(f"🪦 Reaped stale GPU {gpu_id} (no heartbeat for {silence:.0f}s)")
+        try:
+            await info["ws"].close(code=1011)
+        except Exception:
+            pass
+        await _recover_task(info.get("current_task"), gpu_id, "heartbeat timeout")
+    return reaped
+
+
+async def _reaper_loop() -> None:
+    while True:
+        await asyncio.sleep(GPU_REAPER_INTERVAL_S)
+        try:
+            await reap_stale_gpus()
+        except Exception as e:
+            print("🔥 GPU reaper error:", e)
+
+
+def _ensure_reaper() -> None:
+    global _reaper_task
+    if _reaper_task is None or _reaper_task.done():
+        _reaper_task = asyncio.ensure_future(_reaper_loop())
+
+
+def reaper_stats() -> Dict[str, object]:
+    stats = dict(_reaper_stats)
+    silence_total = stats.pop("silence_s_total")
+    stats["avg_detection_s"] = round(silence_total / stats["reaped"], 1) if stats["reaped"] else None
+    stats["heartbeat_timeout_s"] = GPU_HEARTBEAT_TIMEOUT_S
+    stats["interval_s"] = GPU_REAPER_INTERVAL_S
+    return stats
+
+
+def _record_task_duration(ctx: dict) -> None:
+    global _task_duration_s
+    started = ctx.get("dispatched_at")
+    if not started:
+        return
+    duration = time.time() - started
+    _task_duration_s = duration if _task_duration_s is None else 0.8 * _task_duration_s + 0.2 * duration
 
 @router.websocket("/ws/gpu")
 async def gpu_ws(ws: WebSocket):
@@ -394,21 +818,29 @@ async def gpu_ws(ws: WebSocket):
         await ws.close(code=1008)
         return
 
+    caps = parse_capabilities(register_msg)
     gpu_registry[gpu_id] = {
         "ws": ws,
         "status": "idle",
         "last_heartbeat": time.time(),
         "current_task": None,
+        "caps": caps,
     }
-    print(f"🔥 GPU registered: {gpu_id}")
+    register_worker(gpu_id, caps)
+    print(f"🔥 GPU registered: {gpu_id} {caps}")
+    _ensure_reaper()
+    await schedule_tasks()
 
     try:
         while True:
             msg = json.loads(await ws.receive_text())
             msg_type = msg.get("type")
             print(msg)
+            # 任何消息都算存活
+            info = gpu_registry.get(gpu_id)
+            if info is not None and info["ws"] is ws:
+                info["last_heartbeat"] = time.time()
             if msg_type == "heartbeat":
-                gpu_registry[gpu_id]["last_heartbeat"] = time.time()
                 continue
 
             if msg_type == "TASK_LOG":
@@ -425,11 +857,11 @@ async def gpu_ws(ws: WebSocket):
 
                 # GPU 状态恢复
                 if gpu_id in gpu_registry:
-                    gpu_registry[gpu_id]["status"] = "idle"
-                    gpu_registry[gpu_id]["current_task"] = None
+                    set_gpu_status(gpu_id, gpu_registry[gpu_id], "idle")
 
                 # 关联上下文补齐（关键：解决 user_id/prompt 为 null）
                 ctx = task_ctx_map.pop(task_id, {}) if task_id else {}
+                _record_task_duration(ctx)
                 if ctx:
                     msg.setdefault("user_id", ctx.get("user_id"))
                     msg.setdefault("prompt", ctx.get("prompt"))
@@ -446,16 +878,26 @@ async def gpu_ws(ws: WebSocket):
                     await frontend_ws.send_text(json.dumps(msg))
                 else:
                     print(f"⚠️ No frontend websocket found for task {task_id}")
+
+                # GPU 空出来了，立刻拉下一个排队任务
+                await schedule_tasks()
                 continue
 
             print(f"⚠️ Unknown GPU message type: {msg_type}")
 
     except WebSocketDisconnect:
-        gpu_registry.pop(gpu_id, None)
         print(f"❌ GPU disconnected: {gpu_id}")
     except Exception as e:
-        gpu_registry.pop(gpu_id, None)
         print(f"🔥 GPU error ({gpu_id}): {e}")
+    finally:
+        info = _unregister_gpu(gpu_id, ws)
+        if info is not None and info.get("current_task"):
+            _reaper_stats["disconnected_busy"] += 1
+            await _recover_task(info["current_task"], gpu_id, "disconnected")
+
+@router.get("/gpu/pool")
+def gpu_pool_status():
+    return {**pool_stats(), "queued": len(task_queue), "reaper": reaper_stats()}
 
 @router.websocket("/ws")
 async def frontend_ws(ws: WebSocket):
@@ -476,9 +918,6 @@ async def frontend_ws(ws: WebSocket):
             data = json.loads(raw)
             print("📨 Frontend WS message:", data)
 
-            task_id = str(uuid.uuid4())
-            command = build_torchrun_command(data,task_id)
-            print("🧠 Torchrun command:",command)
             # 允许前端发一个 init 消息先绑定用户
             # 约定：{type:"AUTH", token:"..."} 或 {token:"..."} 都可
             if ws_user_id is None:
@@ -536,54 +975,25 @@ async def frontend_ws(ws: WebSocket):
                 await ws.send_text(json.dumps({"type": "IGNORED", "message": "Unsupported message type"}))
                 continue
 
-            # 调度 GPU
-            gpu_id, gpu = select_idle_gpu()
-            if not gpu:
-                await ws.send_text(json.dumps({"type": "TASK_REJECTED", "message": "No idle GPU available"}))
-                continue
-
-            # 构建任务
+            # 构建任务：先入队，预处理（prompt 优化 / motion score）在排队期间并行进行
             task_id = str(uuid.uuid4())
-            command = build_torchrun_command(data,task_id)
-            prompt = (data.get("parameters") or {}).get("prompt")
-
-            # 保存 task 上下文（保证 GPU 回来时一定能补齐 user_id/prompt）
-            task_ctx_map[task_id] = {
-                "user_id": ws_user_id,
-                "prompt": prompt,
-                "created_at": time.time(),
-            }
-
-            gpu["status"] = "busy"
-            gpu["current_task"] = task_id
-
-            task_frontend_map[task_id] = ws
-            task_gpu_map[task_id] = gpu_id
-
-            print(f"📤 Dispatch task {task_id} to GPU {gpu_id}")
-            print("🧠 Torchrun command:")
-            print(command)
-
-            # 发给 GPU：把 user_id/prompt 也带上（这会让 gpu_client 直接回传，不依赖补齐）
-            await gpu["ws"].send_text(
-                json.dumps(
-                    {
-                        "type": "exec_command",
-                        "task_id": task_id,
-                        "command": command,
-                        "user_id": ws_user_id,
-                        "prompt": prompt,
-                    }
-                )
-            )
+            parameters = data.get("parameters") or {}
+            error = validate_task_parameters(parameters, task_id)
+            if error:
+                await ws.send_text(json.dumps({"type": "TASK_REJECTED", "message": error}))
+                continue
+            if len(task_queue) >= GPU_QUEUE_MAX:
+                await ws.send_text(json.dumps({"type": "TASK_REJECTED", "message": "Dispatch queue is full"}))
+                continue
 
-            # Ack 前端
-            await ws.send_text(json.dumps({"type": "TASK_ACCEPTED", "task_id": task_id, "gpu_id": gpu_id}))
+            await enqueue_task(ws, data, ws_user_id, task_id, parameters)
 
     except WebSocketDisconnect:
         print("❌ Frontend disconnected")
     except Exception as e:
         print("🔥 Frontend WS error:", e)
+    finally:
+        _drop_queued_tasks(ws)
 
 from pydantic import BaseModel
 from typing import Literal, Optional, List
@@ -591,6 +1001,9 @@ from fastapi import Header, HTTPException
 import asyncio
 
 from optimizedprompt import refine_prompts
+from app.services.image_prep import image_cache_stats
+from app.services.motion_score import motion_score_stats
+from app.services.prompt_cache import cache_stats as prompt_cache_stats
 
 
 class OptimizePromptReq(BaseModel):
@@ -625,7 +1038,8 @@ async def optimize_prompt(
                 None,
                 lambda: refine_prompts(
                     [raw_prompt],     # ✅ 必须是 list
-                    type="t2v"
+                    type="t2v",
+                    return_errors=True,
                 )
             )
         elif req.type == "IMAGE":
@@ -633,14 +1047,18 @@ async def optimize_prompt(
                 None,
                 lambda: refine_prompts(
                     [raw_prompt],
-                    type="t2i"
+                    type="t2i",
+                    return_errors=True,
                 )
             )
         else:
             raise HTTPException(status_code=400, detail="Unsupported optimize type")
 
-        # refine_prompts 返回的是 list
-        optimized_prompt = result[0] if result else raw_prompt
+        # refine_prompts 返回 (list, errors)；失败要报 5xx，前端才会走本地兜底
+        refined, errors = result
+        if errors:
+            raise RuntimeError(errors[0]["error"])
+        optimized_prompt = refined[0] if refined else raw_prompt
 
         return {
             "optimized_prompt": optimized_prompt
@@ -650,6 +1068,16 @@ async def optimize_prompt(
         print("🔥 optimizePrompt failed:", e)
         raise HTTPException(status_code=500, detail=str(e))
 
+
+@router.get("/optimizePrompt/cache")
+def optimize_prompt_cache():
+    return {"refine": prompt_cache_stats(), "images": image_cache_stats()}
+
+
+@router.get("/optimizePrompt/motion_score/stats")
+def optimize_prompt_motion_stats():
+    return motion_score_stats()
+
 # =========================================================
 # GPU UPLOAD API (GPU -> Server -> OSS + META)
 # =========================================================
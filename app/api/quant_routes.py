@@ -1,17 +1,40 @@
+import datetime
 import json
-import os
+import time
 from typing import Optional
 
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import StreamingResponse
-from openai import OpenAI
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
-from app.schemas.models import EvaluateRequest, EvaluateResponse
-from app.services.asset_eval import estimate_asset_caps
-from app.services.policy import load_policy, resolve_asset_cap
-from app.services.signal import evaluate_single_asset
-from app.services.summary import summarize_signal, summarize_portfolio
-from app.services.ak_tools import get_fund_daily_history, get_fund_daily_summary
+from app.schemas.models import (
+    BacktestJob,
+    BacktestRequest,
+    BatchEvaluateRequest,
+    BatchEvaluateResponse,
+    EvaluateRequest,
+    EvaluateResponse,
+    ScreenResponse,
+)
+from app.services.screener import SORTABLE_COLUMNS, query_screen
+from app.services.context_budget import (
+    CONTEXT_BUDGET_TOKENS,
+    compact_messages,
+    estimate_tokens,
+    fit_tool_payload,
+)
+from app.services.chat_tools import TOOL_PROMPT, normalize_tool_calls, run_tool_calls
+from app.services.chat_router import record_route, route_locally, router_stats
+from app.services.llm import LLMConfigError, achat, get_async_client
+from app.services.sse import SSE_HEADERS, stream_chat_sse
+from app.services.portfolio import evaluate_portfolio, evaluate_portfolios, iter_portfolio_events
+from app.services.eval_cache import cache_stats
+from app.services.backtest_jobs import cancel_backtest_job, get_backtest_job, submit_backtest
+from app.services import fastjson
+from app.services.ak_tools import (
+    get_fund_daily_history,
+    refresh_fund_summaries,
+    tool_cache_stats,
+)
 
 router = APIRouter(prefix="/quant")
 
@@ -20,93 +43,198 @@ class QuantChatReq(BaseModel):
     stream: bool = False
     model: Optional[str] = None
 
-@router.post("/evaluate_assets", response_model=EvaluateResponse)
-def evaluate_assets(req: EvaluateRequest):
-
-    codes = [c for c in req.fund_codes if c.isdigit()]
+def _normalize_codes(fund_codes: list[str]) -> list[str]:
+    codes = list(dict.fromkeys(c.strip() for c in fund_codes if c.strip().isdigit()))
     if not codes:
         raise HTTPException(status_code=400, detail="No valid fund codes")
+    return codes
 
-    policy = load_policy(codes)
-    suggestions = estimate_asset_caps(codes)
+def _validate_date(date: Optional[str]) -> None:
+    if date is None:
+        return
+    try:
+        datetime.date.fromisoformat(date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="date must be YYYY-MM-DD")
 
-    assets_out = []
+@router.post("/evaluate_assets", response_model=EvaluateResponse)
+async def evaluate_assets(req: EvaluateRequest):
 
-    for code in codes:
-        suggested = suggestions.get(code)
-        if not suggested:
-            continue
+    codes = _normalize_codes(req.fund_codes)
+    _validate_date(req.date)
 
-        final_cap = resolve_asset_cap(
-            code,
-            policy,
-            suggested["suggested_cap"]
-        )
+    return await evaluate_portfolio(codes, total_amount=req.total_amount, date=req.date)
 
-        signal = evaluate_single_asset(code, final_cap)
-        summary = summarize_signal(signal)
 
-        assets_out.append({
-            "code": code,
-            "suggested_cap": suggested["suggested_cap"],
-            "policy_cap": policy.get(code, {}).get(
-                "asset_cap",
-                policy["defaults"]["asset_cap"]
-            ),
-            "final_cap": final_cap,
-            "signal": signal,
-            "summary": summary,
-        })
-
-    total_amount = req.total_amount
-    total_pos = sum(float(a["signal"]["final_position"]) for a in assets_out)
-    allocations = []
-
-    for asset in assets_out:
-        target_position = float(asset["signal"]["final_position"])
-        target_amount = (
-            round(total_amount * target_position, 2)
-            if total_amount is not None
-            else None
-        )
-        target_weight = (
-            round(target_position / total_pos, 4)
-            if total_pos > 0
-            else None
-        )
-        allocations.append(
+@router.post("/evaluate_assets/batch", response_model=BatchEvaluateResponse)
+async def evaluate_assets_batch(req: BatchEvaluateRequest):
+    if not req.portfolios:
+        raise HTTPException(status_code=400, detail="No portfolios")
+    _validate_date(req.date)
+
+    portfolios = []
+    for p in req.portfolios:
+        # A portfolio with no usable codes is reported on its own; the rest still run.
+        try:
+            codes, errors = _normalize_codes(p.fund_codes), []
+        except HTTPException as exc:
+            codes = []
+            errors = [{"code": c, "status": "invalid_code", "detail": exc.detail} for c in p.fund_codes] or [
+                {"code": "", "status": "invalid_code", "detail": exc.detail}
+            ]
+        portfolios.append(
             {
-                "code": asset["code"],
-                "target_position": round(target_position, 4),
-                "target_amount": target_amount,
-                "target_weight": target_weight,
+                "id": p.id,
+                "fund_codes": codes,
+                "total_amount": p.total_amount,
+                "errors": errors,
             }
         )
+    return await evaluate_portfolios(portfolios, date=req.date)
+
 
-    total_position_amount = (
-        round(total_amount * total_pos, 2)
-        if total_amount is not None
-        else None
+@router.post("/evaluate_assets/stream")
+async def evaluate_assets_stream(
+    req: EvaluateRequest,
+    format: str = Query("ndjson", pattern="^(ndjson|sse)$"),
+):
+    codes = _normalize_codes(req.fund_codes)
+    _validate_date(req.date)
+
+    async def event_generator():
+        async for event in iter_portfolio_events(codes, total_amount=req.total_amount, date=req.date):
+            if format == "sse":
+                payload = json.dumps(event["data"], ensure_ascii=False)
+                yield f"event: {event['event']}\ndata: {payload}\n\n"
+            else:
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(
+        event_generator(),
+        media_type=media_type,
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+        },
     )
 
-    return {
-        "date": req.date,
-        "assets": assets_out,
-        "portfolio_summary": summarize_portfolio(assets_out, total_amount),
-        "total_amount": total_amount,
-        "total_position_amount": total_position_amount,
-        "allocations": allocations,
+
+@router.get("/evaluate_assets/cache")
+def evaluate_assets_cache_stats():
+    return cache_stats()
+
+
+_BACKTEST_OVERRIDES = (
+    "lookback_n",
+    "th_big",
+    "hard_stop_dd",
+    "rebound_y",
+    "favorable_days",
+    "unfavorable_x",
+    "cap_probe",
+    "cap_active",
+    "fee_bps",
+)
+
+@router.post("/backtest", response_model=BacktestJob)
+async def backtest_submit(req: BacktestRequest):
+    code = req.code.strip()
+    if not code.isdigit():
+        raise HTTPException(status_code=400, detail="Invalid fund code")
+    _validate_date(req.start)
+    _validate_date(req.end)
+
+    params = {
+        "start": req.start,
+        "end": req.end,
+        "asset_cap": req.asset_cap,
+        "nav_points": req.nav_points,
+        "overrides": {
+            k: getattr(req, k) for k in _BACKTEST_OVERRIDES if getattr(req, k) is not None
+        },
     }
+    try:
+        return await submit_backtest(code, params)
+    except Exception as exc:
+        raise HTTPException(status_code=502, detail=f"Failed to load data for {code}: {exc}")
 
 
-@router.post("/chat")
-async def quant_chat(req: QuantChatReq):
-    api_key = os.getenv("CCIOI_API_KEY")
-    if not api_key:
-        raise HTTPException(status_code=500, detail="CCIOI_API_KEY is missing")
+@router.get("/backtest/{job_id}", response_model=BacktestJob)
+def backtest_status(job_id: str):
+    job = get_backtest_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.delete("/backtest/{job_id}", response_model=BacktestJob)
+def backtest_cancel(job_id: str):
+    job = cancel_backtest_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.get("/screen", response_model=ScreenResponse)
+def screen(
+    sort_by: str = "suggested_cap",
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    state: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+):
+    if sort_by not in SORTABLE_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"sort_by must be one of {list(SORTABLE_COLUMNS)}")
+    return query_screen(sort_by=sort_by, order=order, state=state, limit=limit, offset=offset)
+
+
+@router.get("/fund/{code}/history")
+def fund_history(
+    code: str,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    limit: int = Query(120, ge=0),
+    format: str = Query("columns", pattern="^(records|columns)$"),
+):
+    if not code.isdigit():
+        raise HTTPException(status_code=400, detail="Invalid fund code")
+    _validate_date(start)
+    _validate_date(end)
+    try:
+        result = get_fund_daily_history(code, start=start, end=end, limit=limit, format=format)
+    except ValueError as exc:
+        raise HTTPException(status_code=404, detail=str(exc))
+    return Response(content=fastjson.dumps_bytes(result), media_type="application/json")
+
+
+class ToolRefreshReq(BaseModel):
+    codes: Optional[list[str]] = None
+    lookback_days: int = 20
+
+
+@router.post("/tools/refresh")
+def tools_refresh(req: ToolRefreshReq):
+    codes = [c.strip() for c in req.codes if c.strip().isdigit()] if req.codes else None
+    return refresh_fund_summaries(codes, lookback_days=req.lookback_days)
+
+
+@router.get("/tools/cache")
+def tools_cache():
+    return tool_cache_stats()
 
-    base_url = os.getenv("CCIOI_BASE_URL", "https://api.deepseek.com")
-    client = OpenAI(api_key=api_key, base_url=base_url)
+
+@router.get("/chat/router_stats")
+def chat_router_stats():
+    return router_stats()
+
+
+@router.post("/chat")
+async def quant_chat(req: QuantChatReq, request: Request):
+    try:
+        get_async_client("deepseek")
+    except LLMConfigError as exc:
+        raise HTTPException(status_code=500, detail=str(exc))
     model = req.model or "deepseek-chat"
 
     system_guardrail = (
@@ -114,83 +242,62 @@ async def quant_chat(req: QuantChatReq):
         "identity, training data, or provider details. If asked, say you are "
         "a CCIOI assistant and cannot disclose internal implementation details."
     )
-    tool_list = (
-        "Tools:\n"
-        "1) fund_daily_summary(code, lookback_days=20): latest close, 1d/5d/20d return, drawdown.\n"
-        "2) fund_daily_history(code, start=None, end=None, limit=120): OHLCV history.\n"
-        "If tool is needed, respond ONLY with JSON like:\n"
-        '{"tool":"fund_daily_summary","args":{"code":"161226","lookback_days":60}}\n'
-        'or {"tool":"none"}.\n'
-    )
-
-    decision = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": "You are a finance data router."},
-            {"role": "system", "content": system_guardrail},
-            {"role": "system", "content": tool_list},
-            *req.messages,
-        ],
-        stream=False,
-    )
-    decision_text = decision.choices[0].message.content or ""
-    tool_call = {"tool": "none", "args": {}}
-    try:
-        tool_call = json.loads(decision_text)
-    except Exception:
-        tool_call = {"tool": "none", "args": {}}
-
-    tool_result = None
-    if tool_call.get("tool") == "fund_daily_summary":
-        args = tool_call.get("args", {})
-        tool_result = get_fund_daily_summary(
-            code=str(args.get("code", "")).strip(),
-            lookback_days=int(args.get("lookback_days", 20)),
-        )
-    elif tool_call.get("tool") == "fund_daily_history":
-        args = tool_call.get("args", {})
-        tool_result = get_fund_daily_history(
-            code=str(args.get("code", "")).strip(),
-            start=args.get("start"),
-            end=args.get("end"),
-            limit=int(args.get("limit", 120)),
+    calls = route_locally(req.messages)
+    if calls is not None:
+        record_route("local", calls)
+    else:
+        started = time.perf_counter()
+        decision = await achat(
+            "deepseek",
+            model=model,
+            messages=[
+                {"role": "system", "content": "You are a finance data router."},
+                {"role": "system", "content": system_guardrail},
+                {"role": "system", "content": TOOL_PROMPT},
+                *compact_messages(req.messages),
+            ],
+            stream=False,
         )
+        decision_text = decision.choices[0].message.content or ""
+        try:
+            calls = normalize_tool_calls(json.loads(decision_text))
+        except Exception:
+            calls = []
+        record_route("llm", calls, (time.perf_counter() - started) * 1000.0)
+
+    tool_result = await run_tool_calls(calls)
 
-    final_messages = [{"role": "system", "content": system_guardrail}] + list(req.messages)
-    if tool_result is not None:
+    # Keep per-turn prompt size flat: the tool payload gets its own budget and
+    # the history is compacted into whatever is left.
+    if tool_result is None:
+        final_messages = [{"role": "system", "content": system_guardrail}] + compact_messages(req.messages)
+    else:
+        tool_text = f"Tool result: {fastjson.dumps(fit_tool_payload(tool_result))}"
+        history_budget = max(CONTEXT_BUDGET_TOKENS - estimate_tokens(tool_text), 0)
         final_messages = [
             {"role": "system", "content": system_guardrail},
             {"role": "system", "content": "Use the tool result to answer the user."},
-            {"role": "system", "content": f"Tool result: {json.dumps(tool_result, ensure_ascii=False)}"},
-            *req.messages,
+            {"role": "system", "content": tool_text},
+            *compact_messages(req.messages, budget=history_budget),
         ]
 
     if req.stream:
-        def stream_generator():
-            try:
-                response = client.chat.completions.create(
+        return StreamingResponse(
+            stream_chat_sse(
+                request,
+                lambda: achat(
+                    "deepseek",
                     model=model,
                     messages=final_messages,
                     stream=True,
-                )
-                for chunk in response:
-                    delta = chunk.choices[0].delta
-                    content = getattr(delta, "content", None)
-                    if content:
-                        yield f"data: {content}\n\n"
-            except Exception as exc:
-                yield f"data: [ERROR] {exc}\n\n"
-
-        return StreamingResponse(
-            stream_generator(),
+                ),
+            ),
             media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-            },
+            headers=SSE_HEADERS,
         )
 
-    response = client.chat.completions.create(
+    response = await achat(
+        "deepseek",
         model=model,
         messages=final_messages,
         stream=False,
@@ -2,6 +2,12 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.quant_routes import router as quant_router
 from app.api.infra_routes import router as infra_router
+from app.services.portfolio import shutdown_pools
+from app.services.backtest_jobs import shutdown_backtest_pool
+from app.services.llm import close_async_clients
+from app.services.ak_tools import SUMMARY_REFRESH_AT, refresh_fund_summaries
+from app.services.scheduler import start_daily_job, stop_daily_jobs
+from app.services.screener import SCREEN_RUN_AT, run_universe_screen
 
 app = FastAPI(
     title="Quant Asset Evaluator",
@@ -25,6 +31,19 @@ app.add_middleware(
 app.include_router(quant_router)
 app.include_router(infra_router)
 
+@app.on_event("startup")
+async def _start_daily_jobs():
+    start_daily_job("fund summary refresh", SUMMARY_REFRESH_AT, refresh_fund_summaries)
+    if SCREEN_RUN_AT:
+        start_daily_job("universe screen", SCREEN_RUN_AT, run_universe_screen)
+
+@app.on_event("shutdown")
+async def _shutdown_pools():
+    stop_daily_jobs()
+    shutdown_pools()
+    shutdown_backtest_pool()
+    await close_async_clients()
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
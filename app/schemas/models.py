@@ -28,6 +28,11 @@ class Allocation(BaseModel):
     target_amount: Optional[float] = None
     target_weight: Optional[float] = None
 
+class AssetError(BaseModel):
+    code: str
+    status: str
+    detail: Optional[str] = None
+
 class EvaluateResponse(BaseModel):
     date: Optional[str]
     assets: List[AssetResult]
@@ -35,3 +40,75 @@ class EvaluateResponse(BaseModel):
     total_amount: Optional[float] = None
     total_position_amount: Optional[float] = None
     allocations: Optional[List[Allocation]] = None
+    errors: List[AssetError] = []
+
+
+class PortfolioSpec(BaseModel):
+    id: str
+    fund_codes: List[str]
+    total_amount: Optional[float] = None
+
+class BatchEvaluateRequest(BaseModel):
+    portfolios: List[PortfolioSpec]
+    date: Optional[str] = None
+
+class PortfolioResult(EvaluateResponse):
+    id: str
+
+class BatchEvaluateResponse(BaseModel):
+    date: Optional[str]
+    unique_codes: int
+    results: List[PortfolioResult]
+
+
+class ScreenItem(BaseModel):
+    code: str
+    name: Optional[str] = None
+    type: Optional[str] = None
+    asof_date: Optional[str] = None
+    suggested_cap: float
+    final_cap: float
+    ann_vol: float
+    dip_freq: float
+    state: str
+    action: str
+    final_position: float
+    confidence: str
+    updated_at: Optional[float] = None
+
+class ScreenResponse(BaseModel):
+    total: int
+    limit: int
+    offset: int
+    sort_by: str
+    order: str
+    items: List[ScreenItem]
+
+
+class BacktestRequest(BaseModel):
+    code: str
+    start: Optional[str] = None
+    end: Optional[str] = None
+    asset_cap: Optional[float] = None
+    lookback_n: Optional[int] = None
+    th_big: Optional[float] = None
+    hard_stop_dd: Optional[float] = None
+    rebound_y: Optional[float] = None
+    favorable_days: Optional[int] = None
+    unfavorable_x: Optional[float] = None
+    cap_probe: Optional[float] = None
+    cap_active: Optional[float] = None
+    fee_bps: Optional[float] = None
+    nav_points: int = 250
+
+class BacktestJob(BaseModel):
+    job_id: str
+    code: str
+    data_version: str
+    params: Dict[str, Any]
+    status: str
+    cached: bool
+    created_at: float
+    finished_at: Optional[float] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
@@ -1,10 +1,27 @@
 from __future__ import annotations
 
-from typing import Dict, List, Optional
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
 
 import pandas as pd
 
-from app.services.data import load_cn_fund_daily
+from app.services.data import SERIES_TTL_S, load_cn_fund_daily_cached
+from app.services.scheduler import last_daily_run
+
+TOOL_CACHE_SIZE = int(os.getenv("QUANT_TOOL_CACHE_SIZE", "512"))
+# Server-local time after the close when NAVs are in; summaries computed
+# before the latest such time are stale, and the daily refresh runs then.
+SUMMARY_REFRESH_AT = os.getenv("QUANT_SUMMARY_REFRESH_AT", "20:30")
+
+# (code, lookback_days) -> (computed_at, summary of the series' last bar)
+_summary_index: Dict[Tuple[str, int], Tuple[float, Dict[str, object]]] = {}
+# (tool, args, last_bar_date) -> tool result
+_tool_cache: "OrderedDict[tuple, Dict[str, object]]" = OrderedDict()
+_lock = threading.Lock()
+_stats = {"summary_hits": 0, "summary_misses": 0, "history_hits": 0, "history_misses": 0}
 
 
 def _slice_df(df: pd.DataFrame, start: Optional[str], end: Optional[str]) -> pd.DataFrame:
@@ -15,11 +32,18 @@ def _slice_df(df: pd.DataFrame, start: Optional[str], end: Optional[str]) -> pd.
     return df
 
 
-def get_fund_daily_summary(code: str, lookback_days: int = 20) -> Dict[str, object]:
-    df = load_cn_fund_daily(code)
+def _load(code: str) -> pd.DataFrame:
+    df = load_cn_fund_daily_cached(code)
     if df.empty:
         raise ValueError("No data returned from AkShare")
+    return df
 
+
+def _last_bar(df: pd.DataFrame) -> str:
+    return df.index[-1].strftime("%Y-%m-%d")
+
+
+def _compute_summary(df: pd.DataFrame, code: str, lookback_days: int) -> Dict[str, object]:
     df = df.tail(max(lookback_days, 2))
     close = df["close"]
     last_close = float(close.iloc[-1])
@@ -39,7 +63,7 @@ def get_fund_daily_summary(code: str, lookback_days: int = 20) -> Dict[str, obje
 
     return {
         "code": code,
-        "date": df.index[-1].strftime("%Y-%m-%d"),
+        "date": _last_bar(df),
         "close": round(last_close, 4),
         "return_1d": round(ret1, 4),
         "return_5d": round(ret5, 4),
@@ -49,37 +73,117 @@ def get_fund_daily_summary(code: str, lookback_days: int = 20) -> Dict[str, obje
     }
 
 
+def get_fund_daily_summary(code: str, lookback_days: int = 20) -> Dict[str, object]:
+    # Served from the index without touching the series until the next
+    # after-close boundary; refresh_fund_summaries normally rebuilds it then.
+    key = (code, lookback_days)
+    boundary = last_daily_run(SUMMARY_REFRESH_AT).timestamp()
+    with _lock:
+        hit = _summary_index.get(key)
+        if hit is not None and hit[0] >= boundary:
+            _stats["summary_hits"] += 1
+            return dict(hit[1])
+        _stats["summary_misses"] += 1
+
+    # A series cached before the boundary may miss today's bar.
+    now = time.time()
+    df = load_cn_fund_daily_cached(code, ttl=min(SERIES_TTL_S, now - boundary))
+    if df.empty:
+        raise ValueError("No data returned from AkShare")
+    summary = _compute_summary(df, code, lookback_days)
+    with _lock:
+        _summary_index[key] = (now, summary)
+    return dict(summary)
+
+
+def refresh_fund_summaries(codes: Optional[Iterable[str]] = None, lookback_days: int = 20) -> Dict[str, int]:
+    """
+    Daily refresh after close (scheduled at SUMMARY_REFRESH_AT): refetch the
+    series and precompute summaries so that chat lookups are a dict hit.
+    Defaults to every (code, lookback) asked about so far.
+    """
+    if codes is None:
+        with _lock:
+            keys = sorted(_summary_index)
+    else:
+        keys = [(code, lookback_days) for code in codes]
+    refreshed = failed = 0
+    fetched: Dict[str, pd.DataFrame] = {}
+    for code, lookback in keys:
+        try:
+            if code not in fetched:
+                fetched[code] = load_cn_fund_daily_cached(code, ttl=0)
+            summary = _compute_summary(fetched[code], code, lookback)
+        except Exception as exc:
+            print(f"⚠️ summary refresh failed for {code}: {exc}")
+            failed += 1
+            continue
+        with _lock:
+            _summary_index[(code, lookback)] = (time.time(), summary)
+        refreshed += 1
+    return {"refreshed": refreshed, "failed": failed}
+
+
+def tool_cache_stats() -> Dict[str, int]:
+    with _lock:
+        return {**_stats, "summaries": len(_summary_index), "history_entries": len(_tool_cache)}
+
+
+HISTORY_FORMATS = ("records", "columns")
+_OHLCV = ["open", "high", "low", "close", "volume"]
+
+
+def _history_columns(df: pd.DataFrame) -> Dict[str, list]:
+    if "volume" not in df.columns:
+        df = df.assign(volume=0.0)
+    values = df[_OHLCV].astype(float).round(4)
+    columns: Dict[str, list] = {"date": df.index.strftime("%Y-%m-%d").tolist()}
+    for col in _OHLCV:
+        columns[col] = values[col].tolist()
+    return columns
+
+
 def get_fund_daily_history(
     code: str,
     start: Optional[str] = None,
     end: Optional[str] = None,
     limit: int = 120,
+    format: str = "records",
 ) -> Dict[str, object]:
-    df = load_cn_fund_daily(code)
-    if df.empty:
-        raise ValueError("No data returned from AkShare")
+    """
+    format="records" returns a list of row dicts; format="columns" returns one
+    array per field, which is far smaller for long ranges.
+    """
+    if format not in HISTORY_FORMATS:
+        raise ValueError(f"Unsupported history format: {format}")
+    df = _load(code)
+    key = ("fund_daily_history", code, start, end, limit, format, _last_bar(df))
+    with _lock:
+        hit = _tool_cache.get(key)
+        if hit is not None:
+            _tool_cache.move_to_end(key)
+            _stats["history_hits"] += 1
+            return hit
+        _stats["history_misses"] += 1
 
     df = _slice_df(df, start, end)
     if limit > 0:
         df = df.tail(limit)
 
-    records: List[Dict[str, object]] = []
-    for idx, row in df.iterrows():
-        records.append(
-            {
-                "date": idx.strftime("%Y-%m-%d"),
-                "open": round(float(row["open"]), 4),
-                "high": round(float(row["high"]), 4),
-                "low": round(float(row["low"]), 4),
-                "close": round(float(row["close"]), 4),
-                "volume": round(float(row.get("volume", 0.0)), 4),
-            }
-        )
-
-    return {
+    columns = _history_columns(df)
+    result: Dict[str, object] = {
         "code": code,
         "start": start,
         "end": end,
-        "count": len(records),
-        "records": records,
+        "count": len(df),
     }
+    if format == "columns":
+        result["columns"] = columns
+    else:
+        fields = list(columns)
+        result["records"] = [dict(zip(fields, row)) for row in zip(*columns.values())]
+    with _lock:
+        _tool_cache[key] = result
+        while len(_tool_cache) > TOOL_CACHE_SIZE:
+            _tool_cache.popitem(last=False)
+    return result
@@ -1,4 +1,4 @@
-from typing import Dict, Iterable
+from typing import Dict, Iterable, Optional
 
 import pandas as pd
 
@@ -38,6 +38,17 @@ def _estimate_asset_cap_from_close(
     }
 
 
+def estimate_asset_cap_from_df(
+    df: pd.DataFrame,
+    start_date: str = "2015-01-01",
+    min_history_days: int = 252,
+) -> Optional[dict]:
+    df = df[df.index >= start_date]
+    if len(df) < min_history_days:
+        return None
+    return _estimate_asset_cap_from_close(df["close"])
+
+
 def estimate_asset_caps(
     fund_codes: Iterable[str],
     start_date: str = "2015-01-01",
@@ -50,10 +61,9 @@ def estimate_asset_caps(
             continue
         try:
             df = load_cn_fund_daily(code)
-            df = df[df.index >= start_date]
-            if len(df) < 252:
+            stats = estimate_asset_cap_from_df(df, start_date=start_date)
+            if stats is None:
                 continue
-            stats = _estimate_asset_cap_from_close(df["close"])
             results[code] = stats
         except Exception:
             continue
@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import asdict, replace
+from typing import Dict, Optional
+
+import pandas as pd
+
+from app.services.asset_eval import estimate_asset_cap_from_df
+from app.services.checkpoints import get_fsm_trace
+from app.services.data import load_cn_fund_daily_cached
+from app.services.policy import load_policy, resolve_asset_cap
+from app.services.portfolio import ASSET_TIMEOUT_S, get_io_pool
+from app.services.signal import (
+    DEFAULT_CP,
+    DEFAULT_RP,
+    DEFAULT_SP,
+    HISTORY_START,
+    AssetParams,
+    backtest,
+    summarize_backtest,
+)
+
+BACKTEST_WORKERS = int(os.getenv("QUANT_BACKTEST_WORKERS", "2"))
+MAX_JOBS = int(os.getenv("QUANT_BACKTEST_MAX_JOBS", "1000"))
+RESULT_CACHE_SIZE = int(os.getenv("QUANT_BACKTEST_CACHE_SIZE", "512"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+# job_id -> job
+_jobs: "OrderedDict[str, dict]" = OrderedDict()
+# cache key -> result
+_results: "OrderedDict[str, dict]" = OrderedDict()
+# cache key -> job_id of the job currently computing it
+_inflight: Dict[str, str] = {}
+
+_SP_FIELDS = set(asdict(DEFAULT_SP))
+_RP_FIELDS = set(asdict(DEFAULT_RP))
+_CP_FIELDS = set(asdict(DEFAULT_CP))
+
+
+def get_backtest_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=BACKTEST_WORKERS)
+    return _pool
+
+
+def shutdown_backtest_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _params_hash(params: dict) -> str:
+    raw = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def _downsample_nav(nav: pd.Series, points: int) -> Dict[str, list]:
+    step = max(1, math.ceil(len(nav) / max(points, 2)))
+    sampled = nav.iloc[::step]
+    if sampled.index[-1] != nav.index[-1]:
+        sampled = pd.concat([sampled, nav.iloc[-1:]])
+    return {
+        "dates": [d.strftime("%Y-%m-%d") for d in sampled.index],
+        "values": [round(float(v), 4) for v in sampled.values],
+    }
+
+
+def run_backtest(df: pd.DataFrame, code: str, params: dict) -> dict:
+    # Runs in the backtest process pool.
+    overrides = params.get("overrides") or {}
+    sp = replace(DEFAULT_SP, **{k: v for k, v in overrides.items() if k in _SP_FIELDS})
+    rp = replace(DEFAULT_RP, **{k: v for k, v in overrides.items() if k in _RP_FIELDS})
+    cp = replace(DEFAULT_CP, **{k: v for k, v in overrides.items() if k in _CP_FIELDS})
+
+    start = params.get("start") or HISTORY_START
+    end = params.get("end")
+    full = df
+    df = df[df.index >= start]
+    if end:
+        df = df[df.index <= pd.Timestamp(end)]
+    if len(df) < 2:
+        raise ValueError(f"Not enough data for {code} in the requested range")
+
+    asset_cap = params.get("asset_cap")
+    if asset_cap is None:
+        policy = load_policy([code])
+        stats = estimate_asset_cap_from_df(df, start_date=start)
+        suggested = stats["suggested_cap"] if stats else policy["defaults"]["asset_cap"]
+        asset_cap = resolve_asset_cap(code, policy, suggested)
+
+    fsm_trace = None
+    if sp == DEFAULT_SP and rp == DEFAULT_RP and start == HISTORY_START:
+        fsm_trace = get_fsm_trace(code, full).reindex(df.index)
+        if fsm_trace["state"].isna().any():
+            fsm_trace = None
+
+    out = backtest(df, sp, rp, cp, AssetParams(asset_cap=asset_cap), fsm_trace=fsm_trace)
+
+    return {
+        "code": code,
+        "asset_cap": round(float(asset_cap), 4),
+        "start": df.index[0].strftime("%Y-%m-%d"),
+        "end": df.index[-1].strftime("%Y-%m-%d"),
+        "metrics": {k: round(v, 6) for k, v in summarize_backtest(out).items()},
+        "nav": _downsample_nav(out["nav"], int(params.get("nav_points") or 250)),
+    }
+
+
+def _public(job: dict) -> dict:
+    return {k: v for k, v in job.items() if not k.startswith("_")}
+
+
+def _store_job(job: dict) -> None:
+    _jobs[job["job_id"]] = job
+    while len(_jobs) > MAX_JOBS:
+        _, old = _jobs.popitem(last=False)
+        fut = old.get("_future")
+        if fut is not None and not fut.done():
+            fut.cancel()
+
+
+def _store_result(key: str, result: dict) -> None:
+    _results[key] = result
+    _results.move_to_end(key)
+    while len(_results) > RESULT_CACHE_SIZE:
+        _results.popitem(last=False)
+
+
+def _release_inflight(job: dict) -> None:
+    if _inflight.get(job["_key"]) == job["job_id"]:
+        _inflight.pop(job["_key"], None)
+
+
+async def _watch(job: dict, fut: Future) -> None:
+    try:
+        result = await asyncio.wrap_future(fut)
+    except asyncio.CancelledError:
+        job["status"] = "cancelled"
+        return
+    except Exception as exc:
+        if job["status"] != "cancelled":
+            job["status"] = "failed"
+            job["error"] = str(exc)
+        return
+    finally:
+        job["finished_at"] = job["finished_at"] or time.time()
+        _release_inflight(job)
+
+    _store_result(job["_key"], result)
+    if job["status"] != "cancelled":
+        job["status"] = "done"
+        job["result"] = result
+
+
+async def submit_backtest(code: str, params: dict) -> dict:
+    """
+    Queue a backtest. Returns the job view; finished immediately when the same
+    (code, data version, params) was computed before.
+    """
+    loop = asyncio.get_running_loop()
+    df = await asyncio.wait_for(
+        loop.run_in_executor(get_io_pool(), load_cn_fund_daily_cached, code),
+        timeout=ASSET_TIMEOUT_S,
+    )
+    if df.empty:
+        raise ValueError(f"No data for {code}")
+    data_version = df.index[-1].strftime("%Y-%m-%d")
+    key = f"{code}:{data_version}:{_params_hash(params)}"
+
+    if key in _inflight and _inflight[key] in _jobs:
+        return _public(_jobs[_inflight[key]])
+
+    job = {
+        "job_id": uuid.uuid4().hex,
+        "code": code,
+        "data_version": data_version,
+        "params": params,
+        "status": "queued",
+        "cached": False,
+        "created_at": time.time(),
+        "finished_at": None,
+        "result": None,
+        "error": None,
+        "_key": key,
+    }
+
+    cached = _results.get(key)
+    if cached is not None:
+        _results.move_to_end(key)
+        job.update(status="done", cached=True, result=cached, finished_at=time.time())
+        _store_job(job)
+        return _public(job)
+
+    fut = get_backtest_pool().submit(run_backtest, df, code, params)
+    job["_future"] = fut
+    _inflight[key] = job["job_id"]
+    _store_job(job)
+    job["_watcher"] = asyncio.ensure_future(_watch(job, fut))
+    return _public(job)
+
+
+def get_backtest_job(job_id: str) -> Optional[dict]:
+    job = _jobs.get(job_id)
+    if job is None:
+        return None
+    fut = job.get("_future")
+    if job["status"] == "queued" and fut is not None and fut.running():
+        job["status"] = "running"
+    return _public(job)
+
+
+def cancel_backtest_job(job_id: str) -> Optional[dict]:
+    """
+    Queued jobs are dropped from the pool. A job that already started keeps
+    its worker until it finishes, but is marked cancelled and its result is
+    only kept in the cache.
+    """
+    job = _jobs.get(job_id)
+    if job is None:
+        return None
+    if job["status"] in ("queued", "running"):
+        fut = job.get("_future")
+        if fut is not None:
+            fut.cancel()
+        job["status"] = "cancelled"
+        job["finished_at"] = time.time()
+        _release_inflight(job)
+    return _public(job)
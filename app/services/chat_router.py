@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import re
+import threading
+from typing import Dict, List, Optional
+
+_CODE_RE = re.compile(r"(?<!\d)(\d{6})(?!\d)")
+_DATE_RE = re.compile(
+    r"(?<!\d)((?:19|20)\d{2})[-/.年](\d{1,2})[-/.月](\d{1,2})日?(?!\d)"
+    r"|(?<!\d)((?:19|20)\d{2})(\d{2})(\d{2})(?!\d)"
+)
+_DAYS_RE = re.compile(r"(?:最近|近|过去|last|past)\s*(\d{1,4})\s*(?:个)?(?:交易日|天|日|days?|trading days)", re.I)
+
+_HISTORY_WORDS = (
+    "历史", "走势", "k线", "行情", "明细", "每日", "日线", "ohlc", "history", "historical", "kline", "candle", "daily data",
+)
+_SUMMARY_WORDS = (
+    "涨跌", "涨幅", "跌幅", "收益", "回撤", "表现", "最新", "净值", "怎么样", "如何", "今天", "昨天",
+    "对比", "比较", "哪个好",
+    "return", "drawdown", "performance", "summary", "latest", "how is", "how's", "compare", "versus", " vs",
+)
+# A fund named without its code ("沪深300ETF") still needs the LLM router to resolve it.
+_FUND_WORDS = (
+    "基金", "etf", "lof", "指数", "联接", "混合", "债", "股票", "沪深", "中证", "上证", "深证", "创业板", "科创",
+    "恒生", "纳指", "纳斯达克", "标普", "红利", "白酒", "医药", "半导体", "芯片", "新能源", "黄金",
+    "fund", "index", "nasdaq", "s&p",
+)
+
+# Used as the saving per local decision until a real router call has been timed.
+_DEFAULT_LLM_ROUTE_MS = 1500.0
+
+_lock = threading.Lock()
+_stats = {
+    "local": 0,
+    "local_none": 0,
+    "llm": 0,
+    "llm_route_ms_avg": _DEFAULT_LLM_ROUTE_MS,
+    "saved_ms_total": 0.0,
+}
+
+
+def _last_user_text(messages: List[dict]) -> str:
+    for msg in reversed(messages):
+        if msg.get("role") == "user" and isinstance(msg.get("content"), str):
+            return msg["content"]
+    return ""
+
+
+def _earlier_user_codes(messages: List[dict]) -> bool:
+    users = [m for m in messages if m.get("role") == "user" and isinstance(m.get("content"), str)]
+    return any(_CODE_RE.search(m["content"]) for m in users[:-1])
+
+
+def _dates(text: str) -> List[str]:
+    out = []
+    for groups in _DATE_RE.findall(text):
+        y, m, d = groups[:3] if groups[0] else groups[3:]
+        if 1 <= int(m) <= 12 and 1 <= int(d) <= 31:
+            out.append(f"{y}-{int(m):02d}-{int(d):02d}")
+    return sorted(out)
+
+
+def _history_args(code: str, dates: List[str], days: Optional[int]) -> Dict[str, object]:
+    args: Dict[str, object] = {"code": code, "limit": days or 120}
+    if dates:
+        args["start"] = dates[0]
+        args["end"] = dates[-1] if len(dates) > 1 else None
+        args["limit"] = days or 0
+    if args["limit"] == 0 or args["limit"] > 120:
+        args["format"] = "columns"
+    return args
+
+
+def route_locally(messages: List[dict]) -> Optional[List[Dict[str, object]]]:
+    """
+    Deterministic tool routing for the obvious cases.
+    Returns the tool calls the LLM router would pick (possibly empty), or
+    None when unsure.
+    """
+    text = _last_user_text(messages)
+    lowered = text.lower()
+    codes = list(dict.fromkeys(_CODE_RE.findall(text)))
+
+    if not codes:
+        # Follow-ups about a fund mentioned earlier ("它最近怎么样") need the model to resolve.
+        if _earlier_user_codes(messages) or _dates(text):
+            return None
+        # Only turns with no fund or market data in them (greetings, general
+        # questions) are known to need no tool.
+        if any(w in lowered for w in _FUND_WORDS + _HISTORY_WORDS + _SUMMARY_WORDS):
+            return None
+        return []
+
+    dates = _dates(text)
+    days_match = _DAYS_RE.search(text)
+    days = int(days_match.group(1)) if days_match else None
+    wants_history = bool(dates) or any(w in lowered for w in _HISTORY_WORDS)
+    wants_summary = any(w in lowered for w in _SUMMARY_WORDS)
+
+    if wants_history:
+        return [{"tool": "fund_daily_history", "args": _history_args(code, dates, days)} for code in codes]
+
+    if wants_summary:
+        return [
+            {"tool": "fund_daily_summary", "args": {"code": code, "lookback_days": max(days or 20, 2)}}
+            for code in codes
+        ]
+
+    return None
+
+
+def record_route(source: str, calls: List[Dict[str, object]], llm_ms: Optional[float] = None) -> None:
+    """
+    source is "local" or "llm". llm_ms is the measured router call latency,
+    kept as a moving average to estimate what each local decision saved.
+    """
+    with _lock:
+        if source == "llm":
+            _stats["llm"] += 1
+            if llm_ms is not None:
+                _stats["llm_route_ms_avg"] = 0.9 * _stats["llm_route_ms_avg"] + 0.1 * llm_ms
+            return
+        _stats["local"] += 1
+        if not calls:
+            _stats["local_none"] += 1
+        _stats["saved_ms_total"] += _stats["llm_route_ms_avg"]
+
+
+def router_stats() -> Dict[str, float]:
+    with _lock:
+        total = _stats["local"] + _stats["llm"]
+        return {
+            **_stats,
+            "llm_route_ms_avg": round(_stats["llm_route_ms_avg"], 1),
+            "saved_ms_total": round(_stats["saved_ms_total"], 1),
+            "local_ratio": round(_stats["local"] / total, 4) if total else 0.0,
+        }
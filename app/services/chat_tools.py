@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import os
+from typing import Dict, List, Optional
+
+from app.services.ak_tools import HISTORY_FORMATS, get_fund_daily_history, get_fund_daily_summary
+from app.services.portfolio import get_io_pool
+
+TOOL_PARALLELISM = int(os.getenv("QUANT_TOOL_PARALLELISM", "4"))
+MAX_TOOL_CALLS = int(os.getenv("QUANT_MAX_TOOL_CALLS", "8"))
+TOOL_TIMEOUT_S = float(os.getenv("QUANT_TOOL_TIMEOUT", "20"))
+
+TOOL_NAMES = ("fund_daily_summary", "fund_daily_history")
+
+TOOL_PROMPT = (
+    "Tools:\n"
+    "1) fund_daily_summary(code, lookback_days=20): latest close, 1d/5d/20d return, drawdown.\n"
+    "2) fund_daily_history(code, start=None, end=None, limit=120, format=\"records\"): OHLCV history; "
+    "use format=\"columns\" for long ranges.\n"
+    "If tools are needed, respond ONLY with JSON like:\n"
+    '{"calls":[{"tool":"fund_daily_summary","args":{"code":"161226","lookback_days":60}},'
+    '{"tool":"fund_daily_summary","args":{"code":"510300"}}]}\n'
+    "Use one call per fund code, up to 8 calls. If no tool is needed respond "
+    '{"calls":[]}.\n'
+)
+
+
+def normalize_tool_calls(decision: object) -> List[Dict[str, object]]:
+    """
+    Accept {"calls": [...]}, a bare list, or the legacy single
+    {"tool": ..., "args": ...} form. Unknown tools and duplicates are dropped.
+    """
+    if isinstance(decision, dict) and "calls" in decision:
+        raw = decision.get("calls") or []
+    elif isinstance(decision, list):
+        raw = decision
+    elif isinstance(decision, dict):
+        raw = [decision]
+    else:
+        raw = []
+
+    calls: List[Dict[str, object]] = []
+    seen = set()
+    for call in raw:
+        if not isinstance(call, dict) or call.get("tool") not in TOOL_NAMES:
+            continue
+        args = call.get("args") if isinstance(call.get("args"), dict) else {}
+        sig = (call["tool"], tuple(sorted((k, str(v)) for k, v in args.items())))
+        if sig in seen:
+            continue
+        seen.add(sig)
+        calls.append({"tool": call["tool"], "args": args})
+    return calls[:MAX_TOOL_CALLS]
+
+
+def _bind(call: Dict[str, object]) -> functools.partial:
+    args = call["args"]
+    code = str(args.get("code", "")).strip()
+    if call["tool"] == "fund_daily_summary":
+        return functools.partial(
+            get_fund_daily_summary,
+            code=code,
+            lookback_days=int(args.get("lookback_days", 20)),
+        )
+    return functools.partial(
+        get_fund_daily_history,
+        code=code,
+        start=args.get("start"),
+        end=args.get("end"),
+        limit=int(args.get("limit", 120)),
+        format=args.get("format") if args.get("format") in HISTORY_FORMATS else "records",
+    )
+
+
+async def run_tool_calls(
+    calls: List[Dict[str, object]],
+    parallelism: int = TOOL_PARALLELISM,
+    timeout: float = TOOL_TIMEOUT_S,
+) -> Optional[Dict[str, object]]:
+    """
+    Run tool calls concurrently (AkShare tools are blocking, so on the I/O
+    pool) and merge them into one context block. None when there are no calls.
+    """
+    if not calls:
+        return None
+    calls = calls[:MAX_TOOL_CALLS]
+
+    loop = asyncio.get_running_loop()
+    sem = asyncio.Semaphore(parallelism)
+
+    async def _one(call: Dict[str, object]) -> Dict[str, object]:
+        entry: Dict[str, object] = {"tool": call["tool"], "code": str(call["args"].get("code", "")).strip()}
+        async with sem:
+            try:
+                entry["result"] = await asyncio.wait_for(
+                    loop.run_in_executor(get_io_pool(), _bind(call)),
+                    timeout=timeout,
+                )
+            except asyncio.TimeoutError:
+                entry["error"] = f"timeout after {timeout:.0f}s"
+            except Exception as exc:
+                entry["error"] = str(exc)
+        return entry
+
+    results = await asyncio.gather(*(_one(c) for c in calls))
+    if len(results) == 1 and "result" in results[0]:
+        return results[0]["result"]
+    return {"results": results}
@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import os
+import pickle
+from typing import Optional
+
+import pandas as pd
+
+from app.services.signal import (
+    DEFAULT_RP,
+    DEFAULT_SP,
+    HISTORY_START,
+    compute_target_position,
+    run_fsm,
+)
+
+CHECKPOINT_DIR = os.getenv("QUANT_FSM_CHECKPOINT_DIR", "fsm_checkpoints")
+
+# Bump when the FSM or its default parameters change.
+_PARAMS_KEY = repr((DEFAULT_SP, DEFAULT_RP))
+
+
+def _checkpoint_path(code: str) -> str:
+    return os.path.join(CHECKPOINT_DIR, f"{code}.pkl")
+
+
+def _load_checkpoint(code: str) -> Optional[dict]:
+    try:
+        with open(_checkpoint_path(code), "rb") as f:
+            ckpt = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    if ckpt.get("params") != _PARAMS_KEY:
+        return None
+    return ckpt
+
+
+def _save_checkpoint(code: str, ckpt: dict) -> None:
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    path = _checkpoint_path(code)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(ckpt, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def _is_prefix(ckpt: dict, close: pd.Series) -> bool:
+    # qfq prices are rewritten after dividends, so the stored tail must still match.
+    trace = ckpt["trace"]
+    n = len(trace)
+    if n == 0 or n > len(close):
+        return False
+    if close.index[n - 1] != trace.index[-1]:
+        return False
+    return abs(float(close.iloc[n - 1]) - ckpt["last_close"]) <= 1e-9 * max(1.0, abs(ckpt["last_close"]))
+
+
+def get_fsm_trace(code: str, df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per-day FSM state/cap trace for the full history of `df`.
+
+    The trace and the context after its last day are checkpointed on disk, so
+    a new bar only steps the FSM over the new rows, and any past date is a
+    slice of the stored trace instead of a re-run from HISTORY_START.
+    """
+    df = df[df.index >= HISTORY_START]
+    close = df["close"]
+    ret1 = close.pct_change().fillna(0.0)
+    target_eff = compute_target_position(close, DEFAULT_SP).shift(1).fillna(0.0)
+
+    ckpt = _load_checkpoint(code)
+    if ckpt is not None and _is_prefix(ckpt, close):
+        n = len(ckpt["trace"])
+        if n == len(close):
+            return ckpt["trace"]
+        new_trace, ctx = run_fsm(close.iloc[n:], ret1.iloc[n:], target_eff.iloc[n:], DEFAULT_RP, ckpt["ctx"])
+        trace = pd.concat([ckpt["trace"], new_trace])
+    else:
+        trace, ctx = run_fsm(close, ret1, target_eff, DEFAULT_RP)
+
+    if len(trace):
+        try:
+            _save_checkpoint(
+                code,
+                {
+                    "params": _PARAMS_KEY,
+                    "trace": trace,
+                    "ctx": ctx,
+                    "last_close": float(close.iloc[-1]),
+                },
+            )
+        except OSError as exc:
+            print(f"⚠️ FSM checkpoint save failed for {code}: {exc}")
+
+    return trace
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import os
+import re
+from typing import Dict, List, Optional
+
+from app.services import fastjson
+
+CONTEXT_BUDGET_TOKENS = int(os.getenv("CHAT_CONTEXT_BUDGET", "6000"))
+TOOL_BUDGET_TOKENS = int(os.getenv("CHAT_TOOL_BUDGET", "2000"))
+KEEP_RECENT_MESSAGES = int(os.getenv("CHAT_KEEP_RECENT", "6"))
+OLD_TURN_CHARS = 200
+
+_CJK_RE = re.compile(r"[　-〿㐀-䶿一-鿿＀-￯]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Local estimate: ~1 token per CJK character, ~4 characters per token otherwise.
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _content_text(msg: dict) -> str:
+    content = msg.get("content")
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return " ".join(p.get("text", "") for p in content if isinstance(p, dict))
+    return ""
+
+
+def message_tokens(msg: dict) -> int:
+    # ~4 tokens of per-message overhead for role/formatting.
+    return estimate_tokens(_content_text(msg)) + 4
+
+
+def _shorten(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+def compact_messages(
+    messages: List[dict],
+    budget: int = CONTEXT_BUDGET_TOKENS,
+    keep_recent: int = KEEP_RECENT_MESSAGES,
+) -> List[dict]:
+    """
+    Fit a chat history into `budget` tokens. The most recent turns are kept
+    verbatim; older turns are folded into one summary message of truncated
+    snippets, dropping the oldest snippets first if that is still too long.
+    """
+    if sum(message_tokens(m) for m in messages) <= budget:
+        return list(messages)
+
+    system = [m for m in messages if m.get("role") == "system"]
+    dialog = [m for m in messages if m.get("role") != "system"]
+    recent = dialog[-keep_recent:] if keep_recent > 0 else []
+    older = dialog[: len(dialog) - len(recent)]
+
+    # Drop recent turns from the front only if they alone blow the budget;
+    # the last message is always kept.
+    fixed = sum(message_tokens(m) for m in system)
+    while len(recent) > 1 and fixed + sum(message_tokens(m) for m in recent) > budget:
+        older.append(recent.pop(0))
+
+    remaining = budget - fixed - sum(message_tokens(m) for m in recent)
+    snippets = [f"{m.get('role')}: {_shorten(_content_text(m), OLD_TURN_CHARS)}" for m in older]
+    while snippets and estimate_tokens("\n".join(snippets)) + 20 > remaining:
+        snippets.pop(0)
+
+    out = list(system)
+    if snippets:
+        out.append(
+            {
+                "role": "system",
+                "content": "Earlier conversation (condensed):\n" + "\n".join(snippets),
+            }
+        )
+    return out + recent
+
+
+def _trim_rows(result: Dict[str, object], keep: int) -> Dict[str, object]:
+    out = dict(result)
+    if "records" in out:
+        out["records"] = out["records"][-keep:] if keep else []
+    if "columns" in out:
+        out["columns"] = {k: (v[-keep:] if keep else []) for k, v in out["columns"].items()}
+    out["count"] = keep
+    out["truncated"] = True
+    return out
+
+
+def _row_count(result: Dict[str, object]) -> Optional[int]:
+    if isinstance(result.get("records"), list):
+        return len(result["records"])
+    if isinstance(result.get("columns"), dict) and result["columns"].get("date") is not None:
+        return len(result["columns"]["date"])
+    return None
+
+
+def fit_tool_payload(result: object, budget: int = TOOL_BUDGET_TOKENS) -> object:
+    """
+    Trim a tool result to `budget` tokens by keeping the most recent rows of
+    any history payloads. Multi-call results share the budget evenly.
+    """
+    if not isinstance(result, dict) or estimate_tokens(fastjson.dumps(result)) <= budget:
+        return result
+
+    if isinstance(result.get("results"), list):
+        entries = result["results"]
+        share = max(budget // max(len(entries), 1), 1)
+        trimmed = []
+        for entry in entries:
+            if "result" in entry:
+                entry = {**entry, "result": fit_tool_payload(entry["result"], share)}
+            trimmed.append(entry)
+        return {**result, "results": trimmed}
+
+    rows = _row_count(result)
+    if not rows:
+        return result
+
+    lo, hi = 0, rows
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(fastjson.dumps(_trim_rows(result, mid))) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return _trim_rows(result, lo)
@@ -1,6 +1,19 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Tuple
+
 import pandas as pd
 import akshare as ak
 
+SERIES_TTL_S = float(os.getenv("QUANT_SERIES_TTL", "600"))
+SERIES_CACHE_SIZE = int(os.getenv("QUANT_SERIES_CACHE_SIZE", "256"))
+
+# fund_code -> (fetched_at, df), least recently used first
+_series_cache: "OrderedDict[str, Tuple[float, pd.DataFrame]]" = OrderedDict()
+_series_lock = threading.Lock()
+
 
 def is_etf_code(fund_code: str) -> bool:
     fund_code = fund_code.strip()
@@ -62,3 +75,57 @@ def load_cn_fund_daily(fund_code: str) -> pd.DataFrame:
     df = df.sort_values("date").set_index("date")
 
     return df[["open", "high", "low", "close", "volume"]]
+
+
+def load_cn_fund_daily_cached(fund_code: str, ttl: float = SERIES_TTL_S) -> pd.DataFrame:
+    """
+    Same as load_cn_fund_daily, but reuses a fetched series for `ttl` seconds.
+    At most SERIES_CACHE_SIZE series are kept. Callers must not mutate the
+    returned frame in place.
+    """
+    fund_code = fund_code.strip()
+    now = time.time()
+    with _series_lock:
+        hit = _series_cache.get(fund_code)
+        if hit and now - hit[0] < ttl:
+            _series_cache.move_to_end(fund_code)
+            return hit[1]
+
+    df = load_cn_fund_daily(fund_code)
+    with _series_lock:
+        _series_cache[fund_code] = (now, df)
+        _series_cache.move_to_end(fund_code)
+        for code in [c for c, (fetched_at, _) in _series_cache.items() if now - fetched_at >= SERIES_TTL_S]:
+            del _series_cache[code]
+        while len(_series_cache) > SERIES_CACHE_SIZE:
+            _series_cache.popitem(last=False)
+    return df
+
+
+def list_cn_fund_universe(include_open_funds: bool = True) -> pd.DataFrame:
+    """
+    List the AkShare ETF (and optionally open fund) universe.
+    Returns a DataFrame with columns: code, name, type.
+    """
+    frames = []
+
+    etf = ak.fund_etf_spot_em()
+    if etf is not None and not etf.empty:
+        etf = etf.rename(columns={"代码": "code", "名称": "name"})[["code", "name"]]
+        etf["type"] = "etf"
+        frames.append(etf)
+
+    if include_open_funds:
+        funds = ak.fund_name_em()
+        if funds is not None and not funds.empty:
+            funds = funds.rename(columns={"基金代码": "code", "基金简称": "name"})[["code", "name"]]
+            funds["type"] = "open_fund"
+            frames.append(funds)
+
+    if not frames:
+        raise ValueError("No fund universe returned from AkShare")
+
+    df = pd.concat(frames, ignore_index=True)
+    df["code"] = df["code"].astype(str).str.strip()
+    df = df[df["code"].str.fullmatch(r"\d{6}")]
+    return df.drop_duplicates(subset=["code"]).reset_index(drop=True)
@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+EVAL_CACHE_SIZE = int(os.getenv("QUANT_EVAL_CACHE_SIZE", "256"))
+
+CacheKey = Tuple[Tuple[str, ...], Optional[str]]
+
+# key -> {"versions": {code: last_bar_date}, "assets": {code: asset}, "errors": {code: error}}
+_cache: "OrderedDict[CacheKey, dict]" = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "stale": 0}
+
+
+def make_key(codes: Iterable[str], date: Optional[str]) -> CacheKey:
+    return tuple(sorted(set(codes))), date
+
+
+def get_entry(key: CacheKey) -> Optional[dict]:
+    with _lock:
+        entry = _cache.get(key)
+        if entry is not None:
+            _cache.move_to_end(key)
+        return entry
+
+
+def lookup_asset(entry: Optional[dict], code: str, version: str) -> Optional[Tuple[Optional[dict], Optional[dict]]]:
+    """
+    Return (asset, error) for `code` if the entry was built from the same last
+    bar; None means the asset has to be re-evaluated.
+    """
+    with _lock:
+        if entry is None:
+            _stats["misses"] += 1
+            return None
+        if entry["versions"].get(code) != version:
+            _stats["stale"] += 1
+            return None
+        _stats["hits"] += 1
+    return entry["assets"].get(code), entry["errors"].get(code)
+
+
+def put_cached(key: CacheKey, versions: Dict[str, str], assets: List[dict], errors: List[dict]) -> None:
+    entry = {
+        "versions": dict(versions),
+        "assets": {a["code"]: a for a in assets},
+        "errors": {e["code"]: e for e in errors},
+    }
+    with _lock:
+        _cache[key] = entry
+        _cache.move_to_end(key)
+        while len(_cache) > EVAL_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def cache_stats() -> Dict[str, int]:
+    with _lock:
+        return {**_stats, "size": len(_cache)}
+
+
+def clear_cache() -> None:
+    with _lock:
+        _cache.clear()
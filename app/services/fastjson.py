@@ -0,0 +1,20 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps_bytes(obj) -> bytes:
+    """
+    UTF-8 JSON without ASCII escaping; uses orjson when installed.
+    NaN is encoded as null by orjson and as NaN by the stdlib fallback.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps(obj) -> str:
+    return dumps_bytes(obj).decode("utf-8")
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import os
+from collections import OrderedDict
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+# VRAM is bucketed into tiers so workers with 79 and 80 GB share a bucket.
+VRAM_TIERS_GB = tuple(
+    int(v) for v in os.getenv("GPU_VRAM_TIERS", "16,24,40,48,80,141").split(",") if v.strip()
+)
+
+# (vram_tier, configs, max_frames); empty configs / max_frames 0 mean "any".
+BucketKey = Tuple[int, FrozenSet[str], int]
+
+# bucket -> idle gpu_ids, longest idle first
+_idle: Dict[BucketKey, "OrderedDict[str, None]"] = {}
+# gpu_id -> bucket
+_bucket_of: Dict[str, BucketKey] = {}
+# (config, frames, min_vram) -> buckets that can serve it, smallest VRAM first
+_fit_cache: Dict[Tuple[str, int, int], List[BucketKey]] = {}
+
+
+def _vram_tier(vram_gb: float) -> int:
+    if vram_gb <= 0:
+        return 0
+    for tier in VRAM_TIERS_GB:
+        if vram_gb <= tier:
+            return tier
+    return int(vram_gb)
+
+
+def parse_capabilities(register_msg: dict) -> dict:
+    """
+    Capabilities from a GPU registration message. Missing fields mean the
+    worker accepts anything.
+    """
+    configs = register_msg.get("configs") or register_msg.get("supported_configs") or []
+    return {
+        "vram_gb": float(register_msg.get("vram_gb") or 0),
+        "configs": sorted(str(c) for c in configs),
+        "max_frames": int(register_msg.get("max_frames") or 0),
+    }
+
+
+def task_requirements(parameters: dict) -> Tuple[str, int, int]:
+    return (
+        str(parameters.get("config") or ""),
+        int(parameters.get("frames") or 0),
+        int(parameters.get("min_vram_gb") or 0),
+    )
+
+
+def _bucket_key(caps: dict) -> BucketKey:
+    return _vram_tier(caps.get("vram_gb") or 0), frozenset(caps.get("configs") or ()), int(caps.get("max_frames") or 0)
+
+
+def _fits(bucket: BucketKey, req: Tuple[str, int, int]) -> bool:
+    tier, configs, max_frames = bucket
+    config, frames, min_vram = req
+    if configs and config and config not in configs:
+        return False
+    if max_frames and frames > max_frames:
+        return False
+    # Unknown VRAM (tier 0) is only excluded when the task asks for a minimum.
+    return not min_vram or tier >= min_vram
+
+
+def register_worker(gpu_id: str, caps: dict) -> None:
+    remove_worker(gpu_id)
+    key = _bucket_key(caps)
+    if key not in _idle:
+        _idle[key] = OrderedDict()
+        _fit_cache.clear()
+    _bucket_of[gpu_id] = key
+    _idle[key][gpu_id] = None
+
+
+def remove_worker(gpu_id: str) -> None:
+    key = _bucket_of.pop(gpu_id, None)
+    if key is not None:
+        _idle[key].pop(gpu_id, None)
+
+
+def mark_idle(gpu_id: str) -> None:
+    key = _bucket_of.get(gpu_id)
+    if key is not None:
+        _idle[key][gpu_id] = None
+
+
+def mark_busy(gpu_id: str) -> None:
+    key = _bucket_of.get(gpu_id)
+    if key is not None:
+        _idle[key].pop(gpu_id, None)
+
+
+def _candidate_buckets(req: Tuple[str, int, int]) -> List[BucketKey]:
+    buckets = _fit_cache.get(req)
+    if buckets is None:
+        # Best fit: the smallest workers that can run the task come first, so
+        # large-VRAM workers stay free for tasks that need them. Workers that
+        # did not report VRAM count as the smallest.
+        buckets = sorted(
+            (b for b in _idle if _fits(b, req)),
+            key=lambda b: (b[0], len(b[1]) == 0, b[2] or float("inf")),
+        )
+        _fit_cache[req] = buckets
+    return buckets
+
+
+def match_idle(parameters: Optional[dict] = None) -> Optional[str]:
+    """
+    An idle gpu_id able to run a task with `parameters`, or None. Cost depends
+    on the number of distinct hardware buckets, not on the number of workers.
+    """
+    req = task_requirements(parameters or {})
+    for bucket in _candidate_buckets(req):
+        idle = _idle[bucket]
+        if idle:
+            return next(iter(idle))
+    return None
+
+
+def idle_count() -> int:
+    return sum(len(v) for v in _idle.values())
+
+
+def pool_stats() -> Dict[str, object]:
+    return {
+        "workers": len(_bucket_of),
+        "idle": idle_count(),
+        "buckets": [
+            {
+                "vram_tier_gb": tier,
+                "configs": sorted(configs),
+                "max_frames": max_frames,
+                "workers": sum(1 for b in _bucket_of.values() if b == (tier, configs, max_frames)),
+                "idle": len(ids),
+            }
+            for (tier, configs, max_frames), ids in _idle.items()
+        ],
+    }
@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from mimetypes import guess_type
+from typing import Dict, Optional, Tuple
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# GPT-4o fits images into 2048x2048 and then scales the short side to 768,
+# so anything larger is only upload overhead.
+IMAGE_MAX_LONG_SIDE = int(os.getenv("IMAGE_MAX_LONG_SIDE", "2048"))
+IMAGE_MAX_SHORT_SIDE = int(os.getenv("IMAGE_MAX_SHORT_SIDE", "768"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+IMAGE_CACHE_BYTES = int(os.getenv("IMAGE_CACHE_BYTES", str(64 * 1024 * 1024)))
+DIGEST_CACHE_SIZE = 1024
+
+# content sha256 -> data URL
+_url_cache: "OrderedDict[str, str]" = OrderedDict()
+_url_cache_bytes = 0
+# (path, mtime_ns, size) -> content sha256
+_digest_cache: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "bytes_in": 0, "bytes_out": 0}
+
+
+def image_digest(path: str) -> str:
+    """
+    sha256 of the file content, memoized on (path, mtime, size) so repeat
+    requests for an unchanged file do not re-read it.
+    """
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    with _lock:
+        digest = _digest_cache.get(key)
+        if digest is not None:
+            _digest_cache.move_to_end(key)
+            return digest
+
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+
+    with _lock:
+        _digest_cache[key] = digest
+        while len(_digest_cache) > DIGEST_CACHE_SIZE:
+            _digest_cache.popitem(last=False)
+    return digest
+
+
+def _target_size(width: int, height: int) -> Tuple[int, int]:
+    scale = min(
+        1.0,
+        IMAGE_MAX_LONG_SIDE / max(width, height),
+        IMAGE_MAX_SHORT_SIDE / min(width, height),
+    )
+    return max(int(width * scale), 1), max(int(height * scale), 1)
+
+
+def _encode(raw: bytes, fallback_mime: str) -> Tuple[str, bytes]:
+    """
+    Downsize to what the model looks at and re-encode as JPEG. Without Pillow,
+    or for inputs it cannot read, the original bytes are sent unchanged.
+    """
+    if Image is None:
+        return fallback_mime, raw
+    try:
+        with Image.open(io.BytesIO(raw)) as img:
+            img.load()
+            if img.mode in ("RGBA", "LA", "P"):
+                rgba = img.convert("RGBA")
+                canvas = Image.new("RGB", rgba.size, (255, 255, 255))
+                canvas.paste(rgba, mask=rgba.split()[-1])
+                img = canvas
+            elif img.mode != "RGB":
+                img = img.convert("RGB")
+            size = _target_size(*img.size)
+            if size != img.size:
+                img = img.resize(size, Image.LANCZOS)
+            out = io.BytesIO()
+            img.save(out, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    except Exception as e:
+        print(f"⚠️ image preprocessing failed, sending original: {e}")
+        return fallback_mime, raw
+
+    encoded = out.getvalue()
+    if len(encoded) >= len(raw) and fallback_mime == "image/jpeg":
+        return fallback_mime, raw
+    return "image/jpeg", encoded
+
+
+def image_to_data_url(path: str, digest: Optional[str] = None) -> str:
+    """
+    Data URL for an i2v reference image, cached by content hash.
+    """
+    global _url_cache_bytes
+    digest = digest or image_digest(path)
+    with _lock:
+        url = _url_cache.get(digest)
+        if url is not None:
+            _url_cache.move_to_end(digest)
+            _stats["hits"] += 1
+            return url
+        _stats["misses"] += 1
+
+    with open(path, "rb") as f:
+        raw = f.read()
+    mime_type, _ = guess_type(path)
+    mime_type, data = _encode(raw, mime_type or "application/octet-stream")
+    url = f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
+
+    with _lock:
+        _stats["bytes_in"] += len(raw)
+        _stats["bytes_out"] += len(data)
+        if digest not in _url_cache:
+            _url_cache[digest] = url
+            _url_cache_bytes += len(url)
+        while _url_cache_bytes > IMAGE_CACHE_BYTES and len(_url_cache) > 1:
+            _, old = _url_cache.popitem(last=False)
+            _url_cache_bytes -= len(old)
+    return url
+
+
+def image_cache_stats() -> Dict[str, int]:
+    with _lock:
+        return {**_stats, "entries": len(_url_cache), "cached_bytes": _url_cache_bytes}
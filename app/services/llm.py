@@ -0,0 +1,451 @@
+# LLM gateway shared by /chat, /quant/chat and optimizedprompt.
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import httpx
+import openai
+from openai import AsyncAzureOpenAI, AsyncOpenAI, AzureOpenAI, OpenAI
+
+DEFAULT_BASE_URL = "https://api.deepseek.com"
+AZURE_PROVIDERS = ("azure", "azure_backup")
+
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+DEADLINE_S = float(os.getenv("LLM_DEADLINE", "120"))
+BACKOFF_BASE_S = 0.5
+BACKOFF_CAP_S = 8.0
+
+_RETRYABLE = (
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+class LLMConfigError(RuntimeError):
+    pass
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "100")),
+        max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE", "20")),
+        keepalive_expiry=30.0,
+    )
+
+
+_TIMEOUT = httpx.Timeout(DEADLINE_S, connect=10.0)
+
+
+def _provider_config(provider: str) -> Dict[str, str]:
+    if provider == "deepseek":
+        api_key = os.getenv("CCIOI_API_KEY")
+        if not api_key:
+            raise LLMConfigError("CCIOI_API_KEY is missing")
+        return {"api_key": api_key, "base_url": os.getenv("CCIOI_BASE_URL", DEFAULT_BASE_URL)}
+    if provider == "azure":
+        api_key = os.getenv("AZURE_OPENAI_API_KEY")
+        if not api_key:
+            raise LLMConfigError("AZURE_OPENAI_API_KEY is missing")
+        return {
+            "api_key": api_key,
+            "api_version": os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-01"),
+            "azure_endpoint": os.getenv("AZURE_OPENAI_ENDPOINT", "https://aismwus3.openai.azure.com"),
+        }
+    if provider == "azure_backup":
+        endpoint = os.getenv("AZURE_OPENAI_BACKUP_ENDPOINT")
+        api_key = os.getenv("AZURE_OPENAI_BACKUP_API_KEY")
+        if not endpoint or not api_key:
+            raise LLMConfigError("AZURE_OPENAI_BACKUP_ENDPOINT / AZURE_OPENAI_BACKUP_API_KEY is missing")
+        return {
+            "api_key": api_key,
+            "api_version": os.getenv("AZURE_OPENAI_BACKUP_API_VERSION", "2024-02-01"),
+            "azure_endpoint": endpoint,
+        }
+    if provider == "ollama":
+        # Ollama's OpenAI-compatible endpoint; the key is required by the SDK but ignored.
+        return {"api_key": "ollama", "base_url": os.getenv("OLLAMA_URL", "http://localhost:11434") + "/v1"}
+    raise LLMConfigError(f"Unknown LLM provider: {provider}")
+
+
+# (provider, config) -> client; retries are done by the gateway, not the SDK.
+_async_clients: Dict[Tuple, Any] = {}
+_sync_clients: Dict[Tuple, Any] = {}
+_client_lock = threading.Lock()
+
+
+def get_async_client(provider: str = "deepseek"):
+    cfg = _provider_config(provider)
+    key = (provider, *sorted(cfg.items()))
+    client = _async_clients.get(key)
+    if client is None:
+        http_client = httpx.AsyncClient(limits=_limits(), timeout=_TIMEOUT)
+        cls = AsyncAzureOpenAI if provider in AZURE_PROVIDERS else AsyncOpenAI
+        client = cls(**cfg, http_client=http_client, max_retries=0)
+        _async_clients[key] = client
+    return client
+
+
+def get_sync_client(provider: str = "deepseek"):
+    cfg = _provider_config(provider)
+    key = (provider, *sorted(cfg.items()))
+    with _client_lock:
+        client = _sync_clients.get(key)
+        if client is None:
+            http_client = httpx.Client(limits=_limits(), timeout=_TIMEOUT)
+            cls = AzureOpenAI if provider in AZURE_PROVIDERS else OpenAI
+            client = cls(**cfg, http_client=http_client, max_retries=0)
+            _sync_clients[key] = client
+    return client
+
+
+async def close_async_clients() -> None:
+    for client in list(_async_clients.values()):
+        await client.close()
+    _async_clients.clear()
+    with _client_lock:
+        for client in _sync_clients.values():
+            client.close()
+        _sync_clients.clear()
+
+
+# =========================================================
+# Concurrency limits
+# =========================================================
+_async_sems: Dict[Tuple[str, str], asyncio.Semaphore] = {}
+_sync_sems: Dict[Tuple[str, str], threading.BoundedSemaphore] = {}
+
+
+def _async_sem(provider: str, model: str) -> asyncio.Semaphore:
+    key = (provider, model)
+    if key not in _async_sems:
+        _async_sems[key] = asyncio.Semaphore(MAX_CONCURRENCY)
+    return _async_sems[key]
+
+
+def _sync_sem(provider: str, model: str) -> threading.BoundedSemaphore:
+    with _client_lock:
+        if (provider, model) not in _sync_sems:
+            _sync_sems[(provider, model)] = threading.BoundedSemaphore(MAX_CONCURRENCY)
+        return _sync_sems[(provider, model)]
+
+
+# =========================================================
+# Metrics
+# =========================================================
+_metrics_lock = threading.Lock()
+_metrics: Dict[Tuple[str, str], dict] = {}
+
+
+def _record(provider: str, model: str, latency_ms: float, ok: bool, retries: int, usage=None) -> None:
+    with _metrics_lock:
+        m = _metrics.setdefault(
+            (provider, model),
+            {
+                "calls": 0,
+                "errors": 0,
+                "retries": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "latencies": deque(maxlen=500),
+            },
+        )
+        m["calls"] += 1
+        m["retries"] += retries
+        if not ok:
+            m["errors"] += 1
+        m["latencies"].append(latency_ms)
+        if usage is not None:
+            m["prompt_tokens"] += int(getattr(usage, "prompt_tokens", 0) or 0)
+            m["completion_tokens"] += int(getattr(usage, "completion_tokens", 0) or 0)
+
+
+def _pct(values: Deque[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(int(q * len(ordered)), len(ordered) - 1)], 1)
+
+
+def llm_metrics() -> Dict[str, dict]:
+    with _metrics_lock:
+        return {
+            f"{provider}:{model}": {
+                **{k: v for k, v in m.items() if k != "latencies"},
+                "latency_ms_p50": _pct(m["latencies"], 0.5),
+                "latency_ms_p90": _pct(m["latencies"], 0.9),
+                "latency_ms_p99": _pct(m["latencies"], 0.99),
+            }
+            for (provider, model), m in _metrics.items()
+        }
+
+
+def _backoff(attempt: int) -> float:
+    # Full jitter.
+    return random.uniform(0.0, min(BACKOFF_CAP_S, BACKOFF_BASE_S * (2 ** attempt)))
+
+
+# =========================================================
+# Calls
+# =========================================================
+async def achat(provider: str, deadline_s: float = DEADLINE_S, **kwargs):
+    """
+    Async chat.completions.create with retries. kwargs go to the SDK
+    (model, messages, stream, ...). With stream=True the returned stream holds
+    a concurrency slot until it is exhausted or closed.
+    """
+    model = kwargs.get("model", "")
+    client = get_async_client(provider)
+    sem = _async_sem(provider, model)
+    deadline = time.monotonic() + deadline_s
+    started = time.perf_counter()
+    attempt = 0
+
+    try:
+        await asyncio.wait_for(sem.acquire(), max(deadline - time.monotonic(), 0.0))
+    except asyncio.TimeoutError:
+        _record(provider, model, (time.perf_counter() - started) * 1000.0, False, attempt)
+        raise TimeoutError(f"LLM concurrency limit ({MAX_CONCURRENCY}) for {provider}:{model} still full after {deadline_s:.0f}s")
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                response = await client.chat.completions.create(timeout=max(remaining, 1.0), **kwargs)
+                break
+            except _RETRYABLE:
+                delay = _backoff(attempt)
+                if attempt >= MAX_RETRIES or time.monotonic() + delay >= deadline:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+    except BaseException:
+        sem.release()
+        _record(provider, model, (time.perf_counter() - started) * 1000.0, False, attempt)
+        raise
+
+    _record(provider, model, (time.perf_counter() - started) * 1000.0, True, attempt, getattr(response, "usage", None))
+    if kwargs.get("stream"):
+        return _GatedStream(response, sem)
+    sem.release()
+    return response
+
+
+def chat(provider: str, deadline_s: float = DEADLINE_S, **kwargs):
+    """
+    Blocking counterpart of achat for thread-pool callers (non-streaming).
+    """
+    model = kwargs.get("model", "")
+    client = get_sync_client(provider)
+    deadline = time.monotonic() + deadline_s
+    started = time.perf_counter()
+    attempt = 0
+
+    sem = _sync_sem(provider, model)
+    if not sem.acquire(timeout=max(deadline - time.monotonic(), 0.0)):
+        _record(provider, model, (time.perf_counter() - started) * 1000.0, False, attempt)
+        raise TimeoutError(f"LLM concurrency limit ({MAX_CONCURRENCY}) for {provider}:{model} still full after {deadline_s:.0f}s")
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                response = client.chat.completions.create(timeout=max(remaining, 1.0), **kwargs)
+                break
+            except _RETRYABLE:
+                delay = _backoff(attempt)
+                if attempt >= MAX_RETRIES or time.monotonic() + delay >= deadline:
+                    _record(provider, model, (time.perf_counter() - started) * 1000.0, False, attempt)
+                    raise
+                attempt += 1
+                time.sleep(delay)
+            except Exception:
+                _record(provider, model, (time.perf_counter() - started) * 1000.0, False, attempt)
+                raise
+    finally:
+        sem.release()
+
+    _record(provider, model, (time.perf_counter() - started) * 1000.0, True, attempt, getattr(response, "usage", None))
+    return response
+
+
+class _GatedStream:
+    """
+    Wraps an async SDK stream and releases the model's concurrency slot when
+    the stream ends or is closed.
+    """
+
+    def __init__(self, stream, sem: asyncio.Semaphore):
+        self._stream = stream
+        self._sem = sem
+        self._released = False
+
+    def _release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._sem.release()
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                yield chunk
+        finally:
+            self._release()
+
+    async def close(self) -> None:
+        try:
+            await self._stream.close()
+        finally:
+            self._release()
+
+
+# =========================================================
+# Hedged calls
+# =========================================================
+HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+# Hedge delay when the primary has too few samples, and bounds on its p90.
+HEDGE_DEFAULT_S = float(os.getenv("LLM_HEDGE_DEFAULT", "4"))
+HEDGE_MIN_S = 0.5
+HEDGE_MAX_S = 20.0
+
+_hedge_pool: Optional[ThreadPoolExecutor] = None
+_hedge_stats = {"calls": 0, "hedges": 0, "failovers": 0, "backup_wins": 0}
+
+Backend = Tuple[str, str]
+
+
+def parse_backends(spec: str) -> List[Backend]:
+    """
+    "azure:gpt4o,deepseek:deepseek-chat" -> [("azure", "gpt4o"), ...];
+    the model may itself contain colons (e.g. ollama:deepseek-r1:14b).
+    """
+    backends = []
+    for item in spec.split(","):
+        provider, _, model = item.strip().partition(":")
+        if provider and model:
+            backends.append((provider, model))
+    return backends
+
+
+def _get_hedge_pool() -> ThreadPoolExecutor:
+    global _hedge_pool
+    with _client_lock:
+        if _hedge_pool is None:
+            _hedge_pool = ThreadPoolExecutor(max_workers=int(os.getenv("LLM_HEDGE_WORKERS", "16")))
+        return _hedge_pool
+
+
+def _backend_score(provider: str, model: str) -> Optional[float]:
+    # p90 latency inflated by the error rate; None until there are enough samples.
+    with _metrics_lock:
+        m = _metrics.get((provider, model))
+        if m is None or len(m["latencies"]) < HEDGE_MIN_SAMPLES:
+            return None
+        p90 = _pct(m["latencies"], 0.9)
+        error_rate = m["errors"] / m["calls"] if m["calls"] else 0.0
+    return p90 * (1.0 + 4.0 * error_rate)
+
+
+def rank_backends(backends: List[Backend]) -> List[Backend]:
+    """
+    Order backends by observed latency. While the configured primary has no
+    history the configured order is kept.
+    """
+    usable = []
+    for b in backends:
+        try:
+            _provider_config(b[0])
+        except LLMConfigError:
+            continue
+        usable.append(b)
+    if not usable or _backend_score(*usable[0]) is None:
+        return usable
+    scored = [(_backend_score(*b), i, b) for i, b in enumerate(usable)]
+    return [b for _, _, b in sorted(scored, key=lambda t: (t[0] is None, t[0] or 0.0, t[1]))]
+
+
+def _hedge_delay(provider: str, model: str) -> float:
+    with _metrics_lock:
+        m = _metrics.get((provider, model))
+        if m is None or len(m["latencies"]) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_S
+        p90 = _pct(m["latencies"], 0.9)
+    return min(max(p90 / 1000.0, HEDGE_MIN_S), HEDGE_MAX_S)
+
+
+def hedged_chat(backends: List[Backend], deadline_s: float = DEADLINE_S, **kwargs):
+    """
+    Blocking chat across several (provider, model) backends. The best-ranked
+    backend goes first; if it has not answered within its p90, or fails, the
+    next one is started. The first non-empty answer wins; late answers are
+    dropped.
+    """
+    ranked = rank_backends(backends)
+    if not ranked:
+        raise LLMConfigError("No usable LLM backend configured")
+
+    pool = _get_hedge_pool()
+    deadline = time.monotonic() + deadline_s
+    running = {}
+    queue = list(ranked)
+    last_error: Optional[BaseException] = None
+
+    def _launch():
+        provider, model = queue.pop(0)
+        remaining = max(deadline - time.monotonic(), 1.0)
+        fut = pool.submit(chat, provider, remaining, **{**kwargs, "model": model})
+        running[fut] = (provider, model)
+
+    with _metrics_lock:
+        _hedge_stats["calls"] += 1
+    _launch()
+
+    while running:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        first = ranked[0]
+        timeout = min(_hedge_delay(*first), remaining) if queue else remaining
+        done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+
+        if not done:
+            # Primary is slow: hedge with the next backend.
+            with _metrics_lock:
+                _hedge_stats["hedges"] += 1
+            _launch()
+            continue
+
+        for fut in done:
+            backend = running.pop(fut)
+            try:
+                response = fut.result()
+            except Exception as e:
+                last_error = e
+                continue
+            if response.choices and response.choices[0].message.content:
+                if backend != first:
+                    with _metrics_lock:
+                        _hedge_stats["backup_wins"] += 1
+                return response
+
+        if not running and queue:
+            with _metrics_lock:
+                _hedge_stats["failovers"] += 1
+            _launch()
+
+    if last_error is not None:
+        raise last_error
+    raise TimeoutError("No LLM backend answered before the deadline")
+
+
+def hedge_stats() -> Dict[str, object]:
+    with _metrics_lock:
+        stats = dict(_hedge_stats)
+    return stats
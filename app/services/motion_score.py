@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+MOTION_LOG_PATH = os.getenv("MOTION_SCORE_LOG", "motion_scores.jsonl")
+MOTION_MODEL_PATH = os.getenv("MOTION_SCORE_MODEL", "motion_score_model.json")
+# Below this confidence the LLM is asked instead.
+MOTION_CONFIDENCE_MIN = float(os.getenv("MOTION_CONFIDENCE_MIN", "0.6"))
+# Fraction of confident predictions still sent to the LLM to keep measuring accuracy.
+MOTION_SHADOW_RATE = float(os.getenv("MOTION_SHADOW_RATE", "0.05"))
+MOTION_MIN_TRAIN = 50
+SCORE_MIN, SCORE_MAX = 1, 15
+
+_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    "static": (
+        "static", "still", "portrait", "still life", "statue", "sleeping", "asleep",
+        "motionless", "calm", "quiet", "landscape", "architecture", "product shot",
+    ),
+    "low": (
+        "slowly", "gentle", "gently", "breeze", "drifting", "floating", "smiling",
+        "blinking", "breathing", "sitting", "standing", "reading", "talking",
+    ),
+    "mid": (
+        "walk", "walking", "runway", "catwalk", "strolling", "cooking", "playing",
+        "swimming", "waving", "pouring", "flowing", "rain", "snow",
+    ),
+    "high": (
+        "run", "running", "dance", "dancing", "fight", "fighting", "explosion",
+        "race", "racing", "chase", "jump", "jumping", "fast", "rapid", "crash",
+        "waves crashing", "storm", "sprint", "spinning", "skateboard", "surfing",
+    ),
+    "camera": (
+        "tracking shot", "pan", "panning", "zoom", "dolly", "drone", "fpv",
+        "handheld", "orbit", "fly-through", "flythrough",
+    ),
+}
+_GROUPS = tuple(_KEYWORDS)
+_PATTERNS = {
+    group: re.compile(r"\b(" + "|".join(re.escape(w) for w in words) + r")\b")
+    for group, words in _KEYWORDS.items()
+}
+
+# [bias, static, low, mid, high, camera, log1p(words)]; used until a model is trained.
+_DEFAULT_WEIGHTS = [3.0, -2.0, -0.5, 1.0, 3.0, 1.0, 0.0]
+
+_lock = threading.Lock()
+_model: Optional[dict] = None
+_stats = {
+    "predictions": 0,
+    "local_answers": 0,
+    "llm_fallbacks": 0,
+    "shadow_checks": 0,
+    "local_us_total": 0.0,
+    "llm_ms_total": 0.0,
+    "compared": 0,
+    "abs_error_total": 0.0,
+    "exact": 0,
+    "within_1": 0,
+}
+
+_SCORE_RE = re.compile(r"\d+")
+
+
+def features(prompt: str) -> List[float]:
+    text = (prompt or "").lower()
+    counts = [float(len(_PATTERNS[g].findall(text))) for g in _GROUPS]
+    return [1.0, *counts, math.log1p(len(text.split()))]
+
+
+def _load_model() -> dict:
+    global _model
+    if _model is None:
+        model = {"weights": _DEFAULT_WEIGHTS, "samples": 0, "rmse": None}
+        if os.path.exists(MOTION_MODEL_PATH):
+            try:
+                with open(MOTION_MODEL_PATH, "r", encoding="utf-8") as f:
+                    model = json.load(f)
+            except Exception as e:
+                print(f"⚠️ motion score model unreadable, using defaults: {e}")
+        _model = model
+    return _model
+
+
+def _confidence(x: List[float], rmse: Optional[float]) -> float:
+    hits = x[1:1 + len(_GROUPS)]
+    matched = sum(hits)
+    if matched == 0:
+        return 0.2
+    static, high = hits[_GROUPS.index("static")], hits[_GROUPS.index("high")]
+    conf = min(0.5 + 0.15 * matched, 0.95)
+    if static and high:
+        conf = min(conf, 0.4)
+    if rmse is None:
+        # Untrained keyword weights always defer to the LLM, so the logged
+        # training pairs are not limited to prompts the keywords find hard.
+        return round(min(conf, MOTION_CONFIDENCE_MIN / 2), 3)
+    conf *= max(0.3, 1.0 - rmse / 5.0)
+    return round(conf, 3)
+
+
+def predict_motion_score(prompt: str) -> Tuple[int, float]:
+    """
+    Local (score, confidence) from keyword counts and a linear model.
+    """
+    started = time.perf_counter()
+    model = _load_model()
+    x = features(prompt)
+    raw = sum(w * v for w, v in zip(model["weights"], x))
+    score = int(min(max(round(raw), SCORE_MIN), SCORE_MAX))
+    confidence = _confidence(x, model.get("rmse"))
+    with _lock:
+        _stats["predictions"] += 1
+        _stats["local_us_total"] += (time.perf_counter() - started) * 1e6
+    return score, confidence
+
+
+def should_use_local(confidence: float) -> bool:
+    if confidence < MOTION_CONFIDENCE_MIN:
+        return False
+    if MOTION_SHADOW_RATE > 0 and random.random() < MOTION_SHADOW_RATE:
+        with _lock:
+            _stats["shadow_checks"] += 1
+        return False
+    return True
+
+
+def format_motion_score(score: int) -> str:
+    # Same shape as the LLM answer.
+    return f"{score} motion score"
+
+
+def parse_motion_score(text: str) -> Optional[int]:
+    m = _SCORE_RE.search(text or "")
+    if m is None:
+        return None
+    return int(min(max(int(m.group()), SCORE_MIN), SCORE_MAX))
+
+
+def record_local_answer() -> None:
+    with _lock:
+        _stats["local_answers"] += 1
+
+
+def record_llm_score(prompt: str, answer: str, llm_ms: float, local_score: Optional[int]) -> None:
+    """
+    Log an LLM-scored prompt as a training pair and compare it with the local
+    prediction.
+    """
+    score = parse_motion_score(answer)
+    with _lock:
+        _stats["llm_fallbacks"] += 1
+        _stats["llm_ms_total"] += llm_ms
+        if score is not None and local_score is not None:
+            err = abs(score - local_score)
+            _stats["compared"] += 1
+            _stats["abs_error_total"] += err
+            _stats["exact"] += int(err == 0)
+            _stats["within_1"] += int(err <= 1)
+        if score is None:
+            return
+        try:
+            with open(MOTION_LOG_PATH, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"prompt": prompt, "score": score, "ts": time.time()}, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"⚠️ motion score log write failed: {e}")
+
+
+def train_from_log(log_path: Optional[str] = None, l2: float = 1.0) -> Optional[dict]:
+    """
+    Fit the linear model on logged (prompt, LLM score) pairs with ridge
+    regression and persist it. Returns None if there is too little data.
+    """
+    global _model
+    pairs = []
+    with open(log_path or MOTION_LOG_PATH, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+                pairs.append((row["prompt"], float(row["score"])))
+            except (ValueError, KeyError):
+                continue
+    if len(pairs) < MOTION_MIN_TRAIN:
+        return None
+
+    X = np.array([features(p) for p, _ in pairs])
+    y = np.array([s for _, s in pairs])
+    reg = l2 * np.eye(X.shape[1])
+    reg[0, 0] = 0.0  # leave the bias unpenalized
+    w = np.linalg.solve(X.T @ X + reg, X.T @ y)
+    pred = np.clip(np.round(X @ w), SCORE_MIN, SCORE_MAX)
+    rmse = float(np.sqrt(np.mean((pred - y) ** 2)))
+
+    model = {"weights": [float(v) for v in w], "samples": len(pairs), "rmse": round(rmse, 4)}
+    tmp = MOTION_MODEL_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(model, f)
+    os.replace(tmp, MOTION_MODEL_PATH)
+    with _lock:
+        _model = model
+    return model
+
+
+def motion_score_stats() -> Dict[str, object]:
+    model = _load_model()
+    with _lock:
+        s = dict(_stats)
+    total = s["local_answers"] + s["llm_fallbacks"]
+    return {
+        "local_answers": s["local_answers"],
+        "llm_fallbacks": s["llm_fallbacks"],
+        "shadow_checks": s["shadow_checks"],
+        "local_ratio": round(s["local_answers"] / total, 4) if total else None,
+        "local_latency_us_avg": round(s["local_us_total"] / s["predictions"], 1) if s["predictions"] else None,
+        "llm_latency_ms_avg": round(s["llm_ms_total"] / s["llm_fallbacks"], 1) if s["llm_fallbacks"] else None,
+        "compared": s["compared"],
+        "mae_vs_llm": round(s["abs_error_total"] / s["compared"], 3) if s["compared"] else None,
+        "exact_vs_llm": round(s["exact"] / s["compared"], 4) if s["compared"] else None,
+        "within_1_vs_llm": round(s["within_1"] / s["compared"], 4) if s["compared"] else None,
+        "model_samples": model.get("samples", 0),
+        "model_rmse": model.get("rmse"),
+    }
+
+
+if __name__ == "__main__":
+    result = train_from_log()
+    print(f"Motion score model: {result}" if result else "Not enough logged pairs to train")
@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+import time
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "deepseek-r1:14b")
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "8"))
+# Overall budget per call, and the longest silence tolerated between chunks.
+OLLAMA_TIMEOUT_S = float(os.getenv("OLLAMA_TIMEOUT", "120"))
+OLLAMA_READ_TIMEOUT_S = float(os.getenv("OLLAMA_READ_TIMEOUT", "30"))
+
+_OPEN_RE = re.compile(r"<(think|thinking)>")
+_MAX_TAG = len("</thinking>")
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=OLLAMA_POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+class ReasoningStripper:
+    """
+    Drops <think>/<thinking> blocks from a token stream as it arrives. Tags may
+    be split across chunks, so a short tail is held back until it cannot be
+    the start of a tag.
+    """
+
+    def __init__(self):
+        self.answer = ""
+        self.saw_reasoning = False
+        self._pending = ""
+        self._closing: Optional[str] = None
+
+    def feed(self, chunk: str) -> None:
+        self._pending += chunk
+        while self._pending:
+            if self._closing:
+                idx = self._pending.find(self._closing)
+                if idx < 0:
+                    # Keep only enough to match a split closing tag.
+                    self._pending = self._pending[-len(self._closing):]
+                    return
+                self._pending = self._pending[idx + len(self._closing):]
+                self._closing = None
+                continue
+
+            m = _OPEN_RE.search(self._pending)
+            if m:
+                self.answer += self._pending[: m.start()]
+                self._pending = self._pending[m.end():]
+                self._closing = f"</{m.group(1)}>"
+                self.saw_reasoning = True
+                continue
+
+            lt = self._pending.rfind("<")
+            if lt >= 0 and len(self._pending) - lt < _MAX_TAG:
+                self.answer += self._pending[:lt]
+                self._pending = self._pending[lt:]
+            else:
+                self.answer += self._pending
+                self._pending = ""
+            return
+
+    def finish(self) -> str:
+        if not self._closing:
+            self.answer += self._pending
+        self._pending = ""
+        return self.answer
+
+    def answer_complete(self) -> bool:
+        # R1-style output is "<think>...</think>\n\n<answer>"; the answer is
+        # done once a paragraph break follows it.
+        if not self.saw_reasoning or self._closing:
+            return False
+        text = self.answer.lstrip()
+        return bool(text) and "\n\n" in text
+
+
+def strip_reasoning(text: str) -> str:
+    stripper = ReasoningStripper()
+    stripper.feed(text)
+    return stripper.finish().strip()
+
+
+def _final_answer(text: str, saw_reasoning: bool) -> str:
+    cleaned = text.strip()
+    if saw_reasoning:
+        # Reasoning was stripped, so the answer leads; stop at its paragraph break.
+        return cleaned.split("\n\n")[0].strip()
+    # Untagged reasoning may still precede the final answer; take the last line.
+    if "\n" in cleaned:
+        cleaned = cleaned.split("\n")[-1].strip()
+    return cleaned
+
+
+def generate(
+    prompt: str,
+    model: str = OLLAMA_MODEL,
+    temperature: float = 0.7,
+    timeout: float = OLLAMA_TIMEOUT_S,
+) -> str:
+    """
+    Stream a completion from Ollama over the pooled session and return the
+    answer with reasoning removed. The stream is closed as soon as the answer
+    is complete, which also stops generation on the server.
+    """
+    payload = {
+        "model": model,
+        "prompt": prompt,
+        "stream": True,
+        "options": {"temperature": temperature},
+    }
+    deadline = time.monotonic() + timeout
+    stripper = ReasoningStripper()
+
+    with get_session().post(
+        f"{OLLAMA_URL}/api/generate",
+        json=payload,
+        stream=True,
+        timeout=(5.0, OLLAMA_READ_TIMEOUT_S),
+    ) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines():
+            if not line:
+                continue
+            data = json.loads(line)
+            if data.get("error"):
+                raise RuntimeError(data["error"])
+            stripper.feed(data.get("response", ""))
+            if data.get("done"):
+                break
+            if stripper.answer_complete():
+                return _final_answer(stripper.answer, stripper.saw_reasoning)
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Ollama did not finish within {timeout:.0f}s")
+
+    return _final_answer(stripper.finish(), stripper.saw_reasoning)
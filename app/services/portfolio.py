@@ -0,0 +1,296 @@
+from __future__ import annotations
+
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from app.services.asset_eval import estimate_asset_cap_from_df
+from app.services.checkpoints import get_fsm_trace
+from app.services.data import load_cn_fund_daily_cached
+from app.services.eval_cache import get_entry, lookup_asset, make_key, put_cached
+from app.services.policy import load_policy, resolve_asset_cap
+from app.services.signal import evaluate_asset_df
+from app.services.summary import summarize_portfolio, summarize_signal
+
+ASSET_TIMEOUT_S = float(os.getenv("QUANT_ASSET_TIMEOUT", "20"))
+BATCH_CONCURRENCY = int(os.getenv("QUANT_BATCH_CONCURRENCY", "32"))
+
+_io_pool: Optional[ThreadPoolExecutor] = None
+_cpu_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_io_pool() -> ThreadPoolExecutor:
+    global _io_pool
+    if _io_pool is None:
+        _io_pool = ThreadPoolExecutor(
+            max_workers=int(os.getenv("QUANT_IO_WORKERS", "16")),
+            thread_name_prefix="quant-io",
+        )
+    return _io_pool
+
+
+def get_cpu_pool() -> ProcessPoolExecutor:
+    global _cpu_pool
+    if _cpu_pool is None:
+        _cpu_pool = ProcessPoolExecutor(
+            max_workers=int(os.getenv("QUANT_CPU_WORKERS", str(os.cpu_count() or 2)))
+        )
+    return _cpu_pool
+
+
+def shutdown_pools() -> None:
+    global _io_pool, _cpu_pool
+    if _io_pool is not None:
+        _io_pool.shutdown(wait=False, cancel_futures=True)
+        _io_pool = None
+    if _cpu_pool is not None:
+        _cpu_pool.shutdown(wait=False, cancel_futures=True)
+        _cpu_pool = None
+
+
+def _evaluate_frame(df: pd.DataFrame, code: str, policy: dict, asof: Optional[pd.Timestamp] = None) -> Optional[dict]:
+    # Runs in the process pool: cap estimation + FSM backtest on an already loaded frame.
+    fsm_trace = get_fsm_trace(code, df)
+    if asof is not None:
+        df = df[df.index <= asof]
+
+    stats = estimate_asset_cap_from_df(df)
+    if stats is None:
+        return None
+
+    final_cap = resolve_asset_cap(code, policy, stats["suggested_cap"])
+    signal = evaluate_asset_df(df, code, final_cap, fsm_trace=fsm_trace)
+
+    return {
+        "code": code,
+        "suggested_cap": stats["suggested_cap"],
+        "policy_cap": policy["assets"].get(code, {}).get(
+            "asset_cap",
+            policy["defaults"]["asset_cap"],
+        ),
+        "final_cap": final_cap,
+        "signal": signal,
+        "summary": summarize_signal(signal),
+    }
+
+
+async def _evaluate_asset(
+    code: str,
+    policy: dict,
+    entry: Optional[dict],
+    asof: Optional[pd.Timestamp] = None,
+) -> Tuple[str, Optional[dict], Optional[dict]]:
+    loop = asyncio.get_running_loop()
+    df = await loop.run_in_executor(get_io_pool(), load_cn_fund_daily_cached, code)
+    bars = df if asof is None else df[df.index <= asof]
+    if bars.empty:
+        raise ValueError(f"No data for {code}" if asof is None else f"No data for {code} on or before {asof:%Y-%m-%d}")
+    # A past-date result only changes if bars up to that date change.
+    version = bars.index[-1].strftime("%Y-%m-%d")
+
+    cached = lookup_asset(entry, code, version)
+    if cached is not None:
+        return (version, *cached)
+
+    result = await loop.run_in_executor(get_cpu_pool(), _evaluate_frame, df, code, policy, asof)
+    if result is None:
+        return version, None, {"code": code, "status": "insufficient_history", "detail": "less than 252 trading days"}
+    return version, result, None
+
+
+async def evaluate_asset_with_deadline(
+    code: str,
+    policy: dict,
+    timeout: float = ASSET_TIMEOUT_S,
+    entry: Optional[dict] = None,
+    asof: Optional[pd.Timestamp] = None,
+) -> Tuple[Optional[str], Optional[dict], Optional[dict]]:
+    """
+    Returns (data_version, asset_result, error). Exactly one of asset_result
+    and error is set; data_version is None when the series could not be loaded.
+    """
+    try:
+        return await asyncio.wait_for(_evaluate_asset(code, policy, entry, asof), timeout=timeout)
+    except asyncio.TimeoutError:
+        return None, None, {"code": code, "status": "timeout", "detail": f"exceeded {timeout:.1f}s"}
+    except Exception as exc:
+        return None, None, {"code": code, "status": "error", "detail": str(exc)}
+
+
+def build_allocations(assets_out: List[dict], total_amount: Optional[float]) -> Dict[str, object]:
+    total_pos = sum(float(a["signal"]["final_position"]) for a in assets_out)
+    allocations = []
+
+    for asset in assets_out:
+        target_position = float(asset["signal"]["final_position"])
+        target_amount = (
+            round(total_amount * target_position, 2)
+            if total_amount is not None
+            else None
+        )
+        target_weight = (
+            round(target_position / total_pos, 4)
+            if total_pos > 0
+            else None
+        )
+        allocations.append(
+            {
+                "code": asset["code"],
+                "target_position": round(target_position, 4),
+                "target_amount": target_amount,
+                "target_weight": target_weight,
+            }
+        )
+
+    total_position_amount = (
+        round(total_amount * total_pos, 2)
+        if total_amount is not None
+        else None
+    )
+
+    return {
+        "portfolio_summary": summarize_portfolio(assets_out, total_amount),
+        "total_amount": total_amount,
+        "total_position_amount": total_position_amount,
+        "allocations": allocations,
+    }
+
+
+def _cacheable(errors: List[dict]) -> bool:
+    # Timeouts and transient failures must be retried on the next request.
+    return all(e["status"] == "insufficient_history" for e in errors)
+
+
+async def iter_portfolio_events(
+    codes: List[str],
+    total_amount: Optional[float] = None,
+    date: Optional[str] = None,
+    timeout: float = ASSET_TIMEOUT_S,
+) -> AsyncIterator[Dict[str, object]]:
+    """
+    Yield {"event": "asset" | "error", "data": ...} as soon as each asset is
+    done, then a final {"event": "summary", "data": ...} with allocations.
+    `date` (YYYY-MM-DD) evaluates as of the last bar on or before that day.
+    """
+    asof = pd.Timestamp(date) if date else None
+    key = make_key(codes, date)
+    entry = get_entry(key)
+    policy = load_policy(codes)
+
+    assets: Dict[str, dict] = {}
+    errors: Dict[str, dict] = {}
+    versions: Dict[str, Optional[str]] = {}
+
+    # Each asset checks its own data version against the cached entry, so a
+    # cold asset never delays a warm one.
+    tasks = [
+        asyncio.ensure_future(evaluate_asset_with_deadline(code, policy, timeout, entry, asof))
+        for code in codes
+    ]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            version, res, err = await fut
+            if res is not None:
+                versions[res["code"]] = version
+                assets[res["code"]] = res
+                yield {"event": "asset", "data": res}
+            else:
+                versions[err["code"]] = version
+                errors[err["code"]] = err
+                yield {"event": "error", "data": err}
+    finally:
+        # Client went away mid-stream: do not leave orphaned evaluations behind.
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+    if all(versions.values()) and _cacheable(list(errors.values())):
+        put_cached(key, versions, list(assets.values()), list(errors.values()))
+
+    # Allocations depend on total_amount only, so they are rebuilt on every call.
+    assets_out = [assets[c] for c in codes if c in assets]
+    yield {
+        "event": "summary",
+        "data": {
+            "date": date,
+            **build_allocations(assets_out, total_amount),
+            "errors": [errors[c] for c in codes if c in errors],
+        },
+    }
+
+
+async def evaluate_portfolio(
+    codes: List[str],
+    total_amount: Optional[float] = None,
+    date: Optional[str] = None,
+    timeout: float = ASSET_TIMEOUT_S,
+) -> Dict[str, object]:
+    assets: Dict[str, dict] = {}
+    summary: Dict[str, object] = {}
+
+    async for event in iter_portfolio_events(codes, total_amount, date, timeout):
+        if event["event"] == "asset":
+            assets[event["data"]["code"]] = event["data"]
+        elif event["event"] == "summary":
+            summary = event["data"]
+
+    return {
+        **summary,
+        "assets": [assets[c] for c in codes if c in assets],
+    }
+
+
+async def evaluate_portfolios(
+    portfolios: List[dict],
+    date: Optional[str] = None,
+    timeout: float = ASSET_TIMEOUT_S,
+) -> Dict[str, object]:
+    """
+    Evaluate many portfolios at once. Every unique code is loaded and
+    backtested a single time; each portfolio then gets its own allocations
+    and summary built from the shared per-code results. A portfolio's own
+    "errors" (e.g. rejected codes) are passed through to its result.
+    """
+    asof = pd.Timestamp(date) if date else None
+    union = list(dict.fromkeys(c for p in portfolios for c in p["fund_codes"]))
+    policy = load_policy(union)
+
+    # Per-asset deadlines start when the asset actually gets a slot, not while queued.
+    sem = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def _bounded(code: str):
+        async with sem:
+            return await evaluate_asset_with_deadline(code, policy, timeout, None, asof)
+
+    outcomes = await asyncio.gather(*(_bounded(code) for code in union))
+
+    assets: Dict[str, dict] = {}
+    errors: Dict[str, dict] = {}
+    for _, res, err in outcomes:
+        if res is not None:
+            assets[res["code"]] = res
+        else:
+            errors[err["code"]] = err
+
+    results = []
+    for p in portfolios:
+        codes = p["fund_codes"]
+        assets_out = [assets[c] for c in codes if c in assets]
+        results.append(
+            {
+                "id": p["id"],
+                "date": date,
+                "assets": assets_out,
+                **build_allocations(assets_out, p.get("total_amount")),
+                "errors": list(p.get("errors") or []) + [errors[c] for c in codes if c in errors],
+            }
+        )
+
+    return {
+        "date": date,
+        "unique_codes": len(union),
+        "results": results,
+    }
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from optimizedprompt import refine_prompt
+from app.services.motion_score import MOTION_CONFIDENCE_MIN, parse_motion_score, predict_motion_score
+
+# How long after submit a task waits for its enrichment before it may be
+# dispatched with whatever has finished. The task holds no GPU meanwhile.
+PREDISPATCH_GRACE_S = float(os.getenv("PREDISPATCH_GRACE", "10"))
+PREDISPATCH_STAGE_TIMEOUT_S = float(os.getenv("PREDISPATCH_STAGE_TIMEOUT", "30"))
+# motion_score used when "auto" could not be scored confidently.
+DEFAULT_MOTION_SCORE = 6
+
+
+def _refine_caption(prompt: str) -> str:
+    refined = refine_prompt(prompt, type="t2v", timeout=PREDISPATCH_STAGE_TIMEOUT_S)
+    # build_torchrun_command wraps the prompt in double quotes.
+    return refined.strip().replace('"', '\\"')
+
+
+def _score_motion(prompt: str) -> Optional[int]:
+    return parse_motion_score(refine_prompt(prompt, type="motion_score", timeout=PREDISPATCH_STAGE_TIMEOUT_S))
+
+
+def wants_motion_score(parameters: dict) -> bool:
+    return parameters.get("motion_score") in (None, "", "auto")
+
+
+def _fallback_motion_score(prompt: str) -> int:
+    # An untrained model always reports low confidence (see motion_score._confidence).
+    score, confidence = predict_motion_score(prompt)
+    return score if confidence >= MOTION_CONFIDENCE_MIN else DEFAULT_MOTION_SCORE
+
+
+def start_enrichment(parameters: dict) -> Optional[dict]:
+    """
+    Start the independent enrichment stages for a video task concurrently:
+    caption refinement (parameters.optimize_prompt) and motion scoring
+    (motion_score missing or "auto"). Returns None if nothing was requested.
+    """
+    prompt = (parameters.get("prompt") or "").replace('\\"', '"')
+    stages = {}
+    if parameters.get("optimize_prompt") and prompt and not parameters.get("ref_image"):
+        stages["prompt"] = (_refine_caption, prompt)
+    if wants_motion_score(parameters) and prompt:
+        stages["motion_score"] = (_score_motion, prompt)
+    if not stages:
+        return None
+
+    loop = asyncio.get_running_loop()
+    state = {"started": time.perf_counter(), "tasks": {}, "timings": {}}
+
+    async def _stage(name, fn, arg):
+        t0 = time.perf_counter()
+        try:
+            return await loop.run_in_executor(None, fn, arg)
+        finally:
+            state["timings"][name] = round((time.perf_counter() - t0) * 1000.0, 1)
+
+    for name, (fn, arg) in stages.items():
+        state["tasks"][name] = asyncio.ensure_future(_stage(name, fn, arg))
+    return state
+
+
+def cancel_enrichment(state: Optional[dict]) -> None:
+    if state:
+        for task in state["tasks"].values():
+            task.cancel()
+
+
+def enrichment_done(state: Optional[dict]) -> bool:
+    return state is None or all(task.done() for task in state["tasks"].values())
+
+
+async def wait_enrichment(state: Optional[dict], timeout: float) -> None:
+    if not enrichment_done(state):
+        await asyncio.wait(list(state["tasks"].values()), timeout=timeout)
+
+
+async def finish_enrichment(state: Optional[dict], parameters: dict, wait_s: float) -> Tuple[dict, Dict[str, object]]:
+    """
+    Wait up to `wait_s` for the running stages, apply the finished ones and
+    drop the rest, keeping the raw inputs. Returns (parameters, report).
+    """
+    params = dict(parameters)
+    report: Dict[str, object] = {"stages": {}}
+    if state is None:
+        if wants_motion_score(params):
+            params["motion_score"] = _fallback_motion_score(params.get("prompt") or "")
+        return params, report
+
+    tasks = state["tasks"]
+    t0 = time.perf_counter()
+    if wait_s > 0:
+        await asyncio.wait(list(tasks.values()), timeout=wait_s)
+    report["waited_ms"] = round((time.perf_counter() - t0) * 1000.0, 1)
+
+    for name, task in tasks.items():
+        stage = {"ms": state["timings"].get(name)}
+        if not task.done():
+            task.cancel()
+            stage["status"] = "skipped"
+        elif task.cancelled() or task.exception() is not None:
+            stage["status"] = "failed"
+            if not task.cancelled():
+                stage["error"] = str(task.exception())
+        else:
+            value = task.result()
+            if name == "prompt" and value:
+                params["prompt"] = value
+                stage["status"] = "applied"
+            elif name == "motion_score" and value is not None:
+                params["motion_score"] = value
+                stage["status"] = "applied"
+            else:
+                stage["status"] = "failed"
+        report["stages"][name] = stage
+
+    if wants_motion_score(params):
+        params["motion_score"] = _fallback_motion_score(params.get("prompt") or "")
+
+    report["total_ms"] = round((time.perf_counter() - state["started"]) * 1000.0, 1)
+    return params, report
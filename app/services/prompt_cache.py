@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+PROMPT_CACHE_DB = os.getenv("PROMPT_CACHE_DB", "prompt_cache.db")
+PROMPT_CACHE_TTL_S = float(os.getenv("PROMPT_CACHE_TTL", str(7 * 24 * 3600)))
+# In-memory front (entries) and on-disk cap (rows); both evict least recently used.
+PROMPT_CACHE_SIZE = int(os.getenv("PROMPT_CACHE_SIZE", "1024"))
+PROMPT_CACHE_MAX_ROWS = int(os.getenv("PROMPT_CACHE_MAX_ROWS", "50000"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS refine_cache (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_refine_cache_last_used ON refine_cache (last_used);
+"""
+
+# key -> (value, created_at)
+_memory: "OrderedDict[str, tuple]" = OrderedDict()
+_lock = threading.Lock()
+_conn: Optional[sqlite3.Connection] = None
+_stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "expired": 0, "stores": 0}
+
+
+def _db() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(PROMPT_CACHE_DB, check_same_thread=False)
+        _conn.executescript(_SCHEMA)
+    return _conn
+
+
+def normalize_prompt(prompt: str) -> str:
+    return " ".join((prompt or "").split())
+
+
+def make_key(type: str, prompt: str, image_hash: Optional[str], model: str, template_version: str) -> str:
+    raw = json.dumps([type, normalize_prompt(prompt), image_hash, model, template_version], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _remember(key: str, value: str, created_at: float) -> None:
+    _memory[key] = (value, created_at)
+    _memory.move_to_end(key)
+    while len(_memory) > PROMPT_CACHE_SIZE:
+        _memory.popitem(last=False)
+
+
+def get_cached(key: str) -> Optional[str]:
+    now = time.time()
+    with _lock:
+        hit = _memory.get(key)
+        if hit is not None:
+            if now - hit[1] <= PROMPT_CACHE_TTL_S:
+                _memory.move_to_end(key)
+                _stats["memory_hits"] += 1
+                return hit[0]
+            del _memory[key]
+
+        conn = _db()
+        row = conn.execute("SELECT value, created_at FROM refine_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            _stats["misses"] += 1
+            return None
+        value, created_at = row
+        if now - created_at > PROMPT_CACHE_TTL_S:
+            with conn:
+                conn.execute("DELETE FROM refine_cache WHERE key = ?", (key,))
+            _stats["expired"] += 1
+            _stats["misses"] += 1
+            return None
+        with conn:
+            conn.execute("UPDATE refine_cache SET last_used = ? WHERE key = ?", (now, key))
+        _remember(key, value, created_at)
+        _stats["disk_hits"] += 1
+        return value
+
+
+def put_cached(key: str, value: str) -> None:
+    now = time.time()
+    with _lock:
+        _remember(key, value, now)
+        conn = _db()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO refine_cache (key, value, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            conn.execute(
+                "DELETE FROM refine_cache WHERE key IN ("
+                "SELECT key FROM refine_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (PROMPT_CACHE_MAX_ROWS,),
+            )
+        _stats["stores"] += 1
+
+
+def cache_stats() -> Dict[str, object]:
+    with _lock:
+        hits = _stats["memory_hits"] + _stats["disk_hits"]
+        lookups = hits + _stats["misses"]
+        rows = _db().execute("SELECT COUNT(*) FROM refine_cache").fetchone()[0]
+        return {
+            **_stats,
+            "hit_ratio": round(hits / lookups, 4) if lookups else None,
+            "memory_size": len(_memory),
+            "disk_rows": rows,
+        }
+
+
+def clear_cache() -> None:
+    with _lock:
+        _memory.clear()
+        conn = _db()
+        with conn:
+            conn.execute("DELETE FROM refine_cache")
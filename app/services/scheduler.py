@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import time
+from typing import Callable, List, Optional
+
+# Daily jobs started from app startup; times are server-local "HH:MM".
+_jobs: List[asyncio.Task] = []
+
+
+def _at(hhmm: str, day: datetime.datetime) -> datetime.datetime:
+    hour, minute = (int(v) for v in hhmm.split(":"))
+    return day.replace(hour=hour, minute=minute, second=0, microsecond=0)
+
+
+def last_daily_run(hhmm: str, now: Optional[datetime.datetime] = None) -> datetime.datetime:
+    """The most recent time-of-day `hhmm` at or before `now`."""
+    now = now or datetime.datetime.now()
+    boundary = _at(hhmm, now)
+    if boundary > now:
+        boundary -= datetime.timedelta(days=1)
+    return boundary
+
+
+def seconds_until(hhmm: str, now: Optional[datetime.datetime] = None) -> float:
+    now = now or datetime.datetime.now()
+    return (last_daily_run(hhmm, now) + datetime.timedelta(days=1) - now).total_seconds()
+
+
+async def _run_daily(name: str, hhmm: str, fn: Callable[[], object]) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(seconds_until(hhmm))
+        started = time.perf_counter()
+        try:
+            result = await loop.run_in_executor(None, fn)
+            print(f"🕒 {name} finished in {time.perf_counter() - started:.1f}s: {result}")
+        except Exception as e:
+            print(f"⚠️ {name} failed: {e}")
+
+
+def start_daily_job(name: str, hhmm: str, fn: Callable[[], object]) -> None:
+    """Run blocking `fn` on the default executor every day at `hhmm`."""
+    _jobs.append(asyncio.ensure_future(_run_daily(name, hhmm, fn)))
+    print(f"🕒 {name} scheduled daily at {hhmm}")
+
+
+def stop_daily_jobs() -> None:
+    for task in _jobs:
+        task.cancel()
+    _jobs.clear()
@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+import pandas as pd
+
+from app.services.asset_eval import estimate_asset_cap_from_df
+from app.services.checkpoints import get_fsm_trace
+from app.services.data import list_cn_fund_universe, load_cn_fund_daily
+from app.services.policy import load_policy, resolve_asset_cap
+from app.services.signal import evaluate_asset_df
+
+SCREEN_DB_PATH = os.getenv("QUANT_SCREEN_DB", "quant_screen.db")
+# Server-local time of the nightly screen started by the app; empty disables
+# it (e.g. when a cron job runs `python -m app.services.screener` instead).
+SCREEN_RUN_AT = os.getenv("QUANT_SCREEN_RUN_AT", "21:00")
+
+SORTABLE_COLUMNS = ("suggested_cap", "dip_freq", "state", "ann_vol", "final_position", "code")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS screen_results (
+    code TEXT PRIMARY KEY,
+    name TEXT,
+    type TEXT,
+    asof_date TEXT,
+    suggested_cap REAL,
+    final_cap REAL,
+    ann_vol REAL,
+    dip_freq REAL,
+    state TEXT,
+    action TEXT,
+    final_position REAL,
+    confidence TEXT,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_screen_suggested_cap ON screen_results (suggested_cap);
+CREATE INDEX IF NOT EXISTS idx_screen_dip_freq ON screen_results (dip_freq);
+CREATE INDEX IF NOT EXISTS idx_screen_ann_vol ON screen_results (ann_vol);
+CREATE INDEX IF NOT EXISTS idx_screen_state ON screen_results (state, suggested_cap);
+"""
+
+_COLUMNS = (
+    "code",
+    "name",
+    "type",
+    "asof_date",
+    "suggested_cap",
+    "final_cap",
+    "ann_vol",
+    "dip_freq",
+    "state",
+    "action",
+    "final_position",
+    "confidence",
+    "updated_at",
+)
+
+
+def _connect(db_path: Optional[str] = None) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path or SCREEN_DB_PATH)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def screen_single_asset(code: str, policy: dict) -> Optional[Dict[str, object]]:
+    df = load_cn_fund_daily(code)
+    stats = estimate_asset_cap_from_df(df)
+    if stats is None:
+        return None
+
+    final_cap = resolve_asset_cap(code, policy, stats["suggested_cap"])
+    signal = evaluate_asset_df(df, code, final_cap, fsm_trace=get_fsm_trace(code, df))
+
+    return {
+        "code": code,
+        "asof_date": df.index[-1].strftime("%Y-%m-%d"),
+        "suggested_cap": stats["suggested_cap"],
+        "final_cap": final_cap,
+        "ann_vol": stats["ann_vol"],
+        "dip_freq": stats["dip_freq"],
+        "state": signal["state"],
+        "action": signal["action"],
+        "final_position": signal["final_position"],
+        "confidence": signal["confidence"],
+    }
+
+
+def run_universe_screen(
+    codes: Optional[Iterable[str]] = None,
+    max_workers: int = 8,
+    db_path: Optional[str] = None,
+) -> Dict[str, int]:
+    """
+    Nightly batch: estimate caps and the latest signal for the whole universe
+    and upsert them into the screen table. Failed codes are skipped.
+    """
+    if codes is None:
+        universe = list_cn_fund_universe()
+    else:
+        universe = pd.DataFrame({"code": [str(c).strip() for c in codes if str(c).strip()]})
+        universe["name"] = None
+        universe["type"] = None
+
+    names = dict(zip(universe["code"], universe["name"]))
+    types = dict(zip(universe["code"], universe["type"]))
+    code_list = list(names.keys())
+    policy = load_policy(code_list)
+
+    def _job(code: str) -> Optional[Dict[str, object]]:
+        try:
+            return screen_single_asset(code, policy)
+        except Exception as exc:
+            print(f"⚠️ screen failed for {code}: {exc}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(_job, code_list))
+
+    now = time.time()
+    rows = []
+    for row in results:
+        if row is None:
+            continue
+        row["name"] = names.get(row["code"])
+        row["type"] = types.get(row["code"]) or policy["assets"].get(row["code"], {}).get("type")
+        row["updated_at"] = now
+        rows.append(tuple(row[c] for c in _COLUMNS))
+
+    conn = _connect(db_path)
+    try:
+        with conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO screen_results ({', '.join(_COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in _COLUMNS)})",
+                rows,
+            )
+    finally:
+        conn.close()
+
+    return {"total": len(code_list), "stored": len(rows), "failed": len(code_list) - len(rows)}
+
+
+def query_screen(
+    sort_by: str = "suggested_cap",
+    order: str = "desc",
+    state: Optional[str] = None,
+    limit: int = 50,
+    offset: int = 0,
+    db_path: Optional[str] = None,
+) -> Dict[str, object]:
+    if sort_by not in SORTABLE_COLUMNS:
+        raise ValueError(f"Unsupported sort column: {sort_by}")
+    direction = "ASC" if order.lower() == "asc" else "DESC"
+
+    where = ""
+    params: List[object] = []
+    if state:
+        where = "WHERE state = ?"
+        params.append(state.upper())
+
+    conn = _connect(db_path)
+    try:
+        total = conn.execute(f"SELECT COUNT(*) FROM screen_results {where}", params).fetchone()[0]
+        cur = conn.execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM screen_results {where} "
+            f"ORDER BY {sort_by} {direction}, code ASC LIMIT ? OFFSET ?",
+            [*params, limit, offset],
+        )
+        items = [dict(r) for r in cur.fetchall()]
+    finally:
+        conn.close()
+
+    return {
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+        "sort_by": sort_by,
+        "order": direction.lower(),
+        "items": items,
+    }
+
+
+if __name__ == "__main__":
+    # Cron alternative to the in-app schedule, with QUANT_SCREEN_RUN_AT="":
+    #   0 21 * * 1-5  cd /srv/app && python -m app.services.screener
+    stats = run_universe_screen()
+    print(f"Screen finished: {stats}")
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from enum import Enum
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 
 import pandas as pd
 
@@ -149,23 +149,21 @@ class CostParams:
     fee_bps: float = 5.0
 
 
-def backtest(
-    df: pd.DataFrame,
-    sp: MeanReversionParams,
+def run_fsm(
+    close: pd.Series,
+    ret1: pd.Series,
+    target_eff: pd.Series,
     rp: RiskParams,
-    cp: CostParams,
-    ap: AssetParams,
-) -> pd.DataFrame:
-    close = df["close"].copy()
-    ret1 = close.pct_change().fillna(0.0)
-
-    target = compute_target_position(close, sp)
-    target_eff = target.shift(1).fillna(0.0)
-
-    ctx = RiskContext()
+    ctx: Optional[RiskContext] = None,
+) -> Tuple[pd.DataFrame, RiskContext]:
+    """
+    Walk the risk FSM over `close` starting from `ctx`.
+    Returns the per-day state/cap trace and the context after the last day.
+    The trace does not depend on the asset cap, so it can be checkpointed.
+    """
+    ctx = ctx or RiskContext()
     states = []
     caps = []
-    actual_pos = []
 
     for t, close_t in close.items():
         ret1_t = float(ret1.loc[t])
@@ -177,11 +175,34 @@ def backtest(
         if ctx.state == TradeState.PROBE:
             cap_t = min(cap_t, target_eff_t)
 
-        pos_t = min(max(target_eff_t, 0.0), cap_t, ap.asset_cap)
-
         states.append(ctx.state.value)
         caps.append(cap_t)
-        actual_pos.append(pos_t)
+
+    trace = pd.DataFrame({"state": states, "cap": caps}, index=close.index)
+    return trace, ctx
+
+
+def backtest(
+    df: pd.DataFrame,
+    sp: MeanReversionParams,
+    rp: RiskParams,
+    cp: CostParams,
+    ap: AssetParams,
+    fsm_trace: Optional[pd.DataFrame] = None,
+) -> pd.DataFrame:
+    close = df["close"].copy()
+    ret1 = close.pct_change().fillna(0.0)
+
+    target = compute_target_position(close, sp)
+    target_eff = target.shift(1).fillna(0.0)
+
+    if fsm_trace is None:
+        fsm_trace, _ = run_fsm(close, ret1, target_eff, rp)
+
+    pos = pd.concat(
+        [target_eff.clip(lower=0.0), fsm_trace["cap"]],
+        axis=1,
+    ).min(axis=1).clip(upper=ap.asset_cap)
 
     out = pd.DataFrame(
         {
@@ -189,9 +210,9 @@ def backtest(
             "ret1": ret1,
             "target": target,
             "target_eff": target_eff,
-            "state": states,
-            "cap": caps,
-            "pos": pd.Series(actual_pos, index=close.index),
+            "state": fsm_trace["state"],
+            "cap": fsm_trace["cap"],
+            "pos": pos,
         }
     )
 
@@ -205,6 +226,28 @@ def backtest(
     return out
 
 
+def summarize_backtest(out: pd.DataFrame) -> Dict[str, float]:
+    nav = out["nav"]
+    ret = out["strategy_ret"]
+
+    ann_ret = nav.iloc[-1] ** (252.0 / max(len(nav), 1)) - 1.0
+    ann_vol = ret.std() * (252.0 ** 0.5)
+    sharpe = (ret.mean() / (ret.std() + 1e-12)) * (252.0 ** 0.5)
+
+    res = {
+        "ann_ret": float(ann_ret),
+        "ann_vol": float(ann_vol),
+        "sharpe": float(sharpe),
+        "max_drawdown": float(out["dd"].min()),
+        "avg_position": float(out["pos"].mean()),
+        "trade_days": float((out["turnover"] > 1e-12).sum()),
+        "total_cost": float(out["cost"].sum()),
+    }
+    for k, v in out["state"].value_counts(normalize=True).to_dict().items():
+        res[f"state_{k}_ratio"] = float(v)
+    return res
+
+
 def export_daily_signal(
     out: pd.DataFrame,
     fund_code: str,
@@ -254,21 +297,44 @@ def export_daily_signal(
     }
 
 
+HISTORY_START = "2015-01-01"
+
+DEFAULT_SP = MeanReversionParams(lookback_n=5, th_mid=-0.02, th_big=-0.05)
+DEFAULT_RP = RiskParams(
+    hard_stop_dd=0.10,
+    rebound_y=0.02,
+    favorable_days=3,
+    unfavorable_x=0.02,
+    cap_probe=0.25,
+    cap_active=1.0,
+)
+DEFAULT_CP = CostParams(fee_bps=10.0)
+
+
 def evaluate_single_asset(code: str, asset_cap: float) -> dict:
     df = load_cn_fund_daily(code)
-    df = df[df.index >= "2015-01-01"].copy()
-
-    sp = MeanReversionParams(lookback_n=5, th_mid=-0.02, th_big=-0.05)
-    rp = RiskParams(
-        hard_stop_dd=0.10,
-        rebound_y=0.02,
-        favorable_days=3,
-        unfavorable_x=0.02,
-        cap_probe=0.25,
-        cap_active=1.0,
-    )
-    cp = CostParams(fee_bps=10.0)
+    return evaluate_asset_df(df, code, asset_cap)
+
+
+def evaluate_asset_df(
+    df: pd.DataFrame,
+    code: str,
+    asset_cap: float,
+    fsm_trace: Optional[pd.DataFrame] = None,
+) -> dict:
+    """
+    Latest signal for `df`. Pass a frame truncated at a past date for a
+    point-in-time signal; `fsm_trace` (e.g. a checkpoint covering at least
+    those days) skips re-running the FSM loop.
+    """
+    df = df[df.index >= HISTORY_START].copy()
+
+    if fsm_trace is not None:
+        fsm_trace = fsm_trace.reindex(df.index)
+        if fsm_trace["state"].isna().any():
+            fsm_trace = None
+
     ap = AssetParams(asset_cap=asset_cap)
 
-    out = backtest(df, sp, rp, cp, ap)
+    out = backtest(df, DEFAULT_SP, DEFAULT_RP, DEFAULT_CP, ap, fsm_trace=fsm_trace)
     return export_daily_signal(out, code, asset_cap)
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from fastapi import Request
+
+FLUSH_INTERVAL_S = float(os.getenv("SSE_FLUSH_INTERVAL", "0.05"))
+FLUSH_CHARS = int(os.getenv("SSE_FLUSH_CHARS", "256"))
+KEEPALIVE_S = float(os.getenv("SSE_KEEPALIVE", "15"))
+# Deltas buffered between upstream and client; a full queue stops reading upstream.
+QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", "256"))
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+}
+
+_END = object()
+
+
+def sse_frame(data: str, event: Optional[str] = None) -> str:
+    """
+    Encode one SSE event; every line of `data` gets its own `data:` field so
+    that clients rebuild embedded newlines.
+    """
+    head = f"event: {event}\n" if event else ""
+    body = "".join(f"data: {line}\n" for line in data.split("\n"))
+    return f"{head}{body}\n"
+
+
+async def _close_upstream(stream) -> None:
+    close = getattr(stream, "close", None)
+    if close is None:
+        return
+    try:
+        res = close()
+        if asyncio.iscoroutine(res):
+            await res
+    except Exception:
+        pass
+
+
+async def stream_chat_sse(
+    request: Request,
+    open_stream: Callable[[], Awaitable[object]],
+) -> AsyncIterator[str]:
+    """
+    Relay an async OpenAI chat stream as SSE.
+
+    Deltas are coalesced into one frame per FLUSH_INTERVAL_S / FLUSH_CHARS.
+    Keep-alive comments are sent while upstream is silent. The upstream
+    request is closed as soon as the client disconnects or the generator is
+    dropped.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    upstream = None
+
+    async def _pump() -> None:
+        nonlocal upstream
+        try:
+            upstream = await open_stream()
+            async for chunk in upstream:
+                if not chunk.choices:
+                    continue
+                content = getattr(chunk.choices[0].delta, "content", None)
+                if content:
+                    await queue.put(content)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            await queue.put(exc)
+        await queue.put(_END)
+
+    producer = asyncio.ensure_future(_pump())
+    buf: list = []
+    buf_chars = 0
+    first_at: Optional[float] = None
+    last_sent = time.monotonic()
+
+    try:
+        while True:
+            now = time.monotonic()
+            if buf:
+                wait = max(FLUSH_INTERVAL_S - (now - first_at), 0.0)
+            else:
+                wait = max(KEEPALIVE_S - (now - last_sent), 0.0)
+
+            item = None
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=min(wait, 1.0))
+            except asyncio.TimeoutError:
+                pass
+
+            if await request.is_disconnected():
+                break
+
+            if isinstance(item, str):
+                if not buf:
+                    first_at = time.monotonic()
+                buf.append(item)
+                buf_chars += len(item)
+
+            now = time.monotonic()
+            done = item is _END or isinstance(item, Exception)
+            if buf and (done or buf_chars >= FLUSH_CHARS or now - first_at >= FLUSH_INTERVAL_S):
+                yield sse_frame("".join(buf))
+                buf, buf_chars, first_at = [], 0, None
+                last_sent = now
+            elif not buf and now - last_sent >= KEEPALIVE_S:
+                yield ": keep-alive\n\n"
+                last_sent = now
+
+            if isinstance(item, Exception):
+                yield sse_frame(f"[ERROR] {item}")
+                break
+            if item is _END:
+                break
+    finally:
+        producer.cancel()
+        await _close_upstream(upstream)
@@ -186,17 +186,22 @@ const QuantTool: React.FC = () => {
           const { done, value } = await reader.read();
           if (done) break;
           sseBuffer += decoder.decode(value, { stream: true });
-          const lines = sseBuffer.split('\n');
-          sseBuffer = lines.pop() || "";
+          // One SSE event per blank-line-terminated block; multi-line content
+          // arrives as several data: lines joined by newlines.
+          const events = sseBuffer.split('\n\n');
+          sseBuffer = events.pop() || "";
 
           let updated = false;
-          for (const line of lines) {
-            if (line.trim().startsWith('data: ')) {
-              const content = line.trim().slice(6);
-              if (content !== '[DONE]') {
-                accumulatedText += content;
-                updated = true;
-              }
+          for (const event of events) {
+            const dataLines = event
+              .split('\n')
+              .filter(line => line.startsWith('data:'))
+              .map(line => line.slice(line.startsWith('data: ') ? 6 : 5));
+            if (dataLines.length === 0) continue;
+            const content = dataLines.join('\n');
+            if (content !== '[DONE]') {
+              accumulatedText += content;
+              updated = true;
             }
           }
           if (updated) {
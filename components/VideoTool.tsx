@@ -36,6 +36,8 @@ const VideoTool: React.FC = () => {
   const [aspectRatio, setAspectRatio] = useState('9:16');
   const [fps, setFps] = useState(16);
   const [motionScore, setMotionScore] = useState(6);
+  const [motionAuto, setMotionAuto] = useState(true);
+  const [serverOptimize, setServerOptimize] = useState(false);
   const [refImage, setRefImage] = useState<string | null>(null);
   const [refImageUrl, setRefImageUrl] = useState<string | null>(null);
   const [isUploading, setIsUploading] = useState(false);
@@ -65,6 +67,14 @@ const VideoTool: React.FC = () => {
         if (data.type === 'TASK_LOG') {
           setLogs(prev => [...prev, { stream: data.stream, line: data.line }]);
         }
+        if (data.type === 'TASK_QUEUED') {
+          const eta = data.estimated_wait_s != null ? `, ~${Math.round(data.estimated_wait_s)}s left` : '';
+          setLogs(prev => [...prev, { stream: 'stdout', line: `Waiting for GPU: position ${data.position}/${data.queue_length} (${Math.round(data.waited_s)}s${eta})` }]);
+        }
+        if (data.type === 'TASK_REJECTED') {
+          setIsGenerating(false);
+          notify.error(data.message || "Task rejected.");
+        }
         if (data.type === 'task_finished') {
           if (data.status === 'success' && data.output?.public_url) {
             setGeneratedVideoUrl(data.output.public_url);
@@ -131,7 +141,7 @@ const VideoTool: React.FC = () => {
       if (!isConnected) await connect();
       sendCommand({
         type: 'TASK_EXECUTION', task: 'VIDEO_GENERATION', token: user.token, timestamp: new Date().toISOString(),
-        parameters: { prompt: prompt.replace(/"/g, '\\"'), config: configFile, cond: condType, steps: numSteps, frames: numFrames, ratio: aspectRatio, fps, motion_score: motionScore, ref_image: refImageUrl }
+        parameters: { prompt: prompt.replace(/"/g, '\\"'), config: configFile, cond: condType, steps: numSteps, frames: numFrames, ratio: aspectRatio, fps, motion_score: motionAuto ? 'auto' : motionScore, optimize_prompt: serverOptimize, ref_image: refImageUrl }
       });
       notify.info("Task dispatched to CCIOI Cluster.");
     } catch (err) {
@@ -181,6 +191,8 @@ const VideoTool: React.FC = () => {
               <div><label className="text-[8px] font-bold text-app-subtext uppercase block mb-0.5">{t('tool.video.frames')}</label><input type="number" value={numFrames} onChange={e => setNumFrames(parseInt(e.target.value))} className="w-full bg-app-base p-1 rounded text-[10px]" /></div>
               <div><label className="text-[8px] font-bold text-app-subtext uppercase block mb-0.5">{t('tool.video.aspect_ratio')}</label><input type="text" value={aspectRatio} onChange={e => setAspectRatio(e.target.value)} className="w-full bg-app-base p-1 rounded text-[10px]" /></div>
               <div><label className="text-[8px] font-bold text-app-subtext uppercase block mb-0.5">{t('tool.video.fps')}</label><input type="number" value={fps} onChange={e => setFps(parseInt(e.target.value))} className="w-full bg-app-base p-1 rounded text-[10px]" /></div>
+              <div><label className="text-[8px] font-bold text-app-subtext uppercase flex items-center justify-between mb-0.5">{t('tool.video.motion_score')}<span className="flex items-center gap-1"><input type="checkbox" checked={motionAuto} onChange={e => setMotionAuto(e.target.checked)} />auto</span></label><input type="number" min={1} max={15} value={motionScore} disabled={motionAuto} onChange={e => setMotionScore(parseInt(e.target.value))} className="w-full bg-app-base p-1 rounded text-[10px] disabled:opacity-40" /></div>
+              <div className="flex items-end"><label className="text-[8px] font-bold text-app-subtext uppercase flex items-center gap-1.5 p-1"><input type="checkbox" checked={serverOptimize} disabled={!!refImageUrl} onChange={e => setServerOptimize(e.target.checked)} />{t('tool.video.optimize_on_dispatch')}</label></div>
             </div>
             <button onClick={handleDispatch} disabled={isGenerating || isUploading} className={`w-full py-3 rounded-xl font-bold shadow-lg flex items-center justify-center gap-2 transition-all uppercase tracking-widest text-[10px] ${!user ? 'bg-app-surface text-app-subtext border border-app-border cursor-not-allowed' : 'bg-gradient-to-r from-cyan-600 to-blue-600 hover:from-cyan-500 text-white shadow-cyan-900/30'}`}>
               {isGenerating || isConnecting ? <Loader2 className="w-3.5 h-3.5 animate-spin" /> : !user ? <Lock className="w-3.5 h-3.5" /> : <Play className="w-3.5 h-3.5 fill-current" />}
@@ -1,10 +1,36 @@
-import base64
 import os
-from mimetypes import guess_type
-from openai import AzureOpenAI
-from openai import OpenAI
-import requests
-import re
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.services.llm import AZURE_PROVIDERS, DEADLINE_S, get_sync_client, hedged_chat, parse_backends
+from app.services.ollama import OLLAMA_MODEL, generate as ollama_generate, strip_reasoning
+from app.services.image_prep import image_digest, image_to_data_url
+from app.services.motion_score import (
+    format_motion_score,
+    predict_motion_score,
+    record_llm_score,
+    record_local_answer,
+    should_use_local,
+)
+from app.services.prompt_cache import get_cached, make_key, put_cached
+
+REFINE_MODEL = "gpt4o"  # glm-4-plus and gpt4o have be tested
+# Backends raced by hedged_chat, primary first, e.g.
+# "azure:gpt4o,azure_backup:gpt4o,deepseek:deepseek-chat,ollama:deepseek-r1:14b".
+# Unconfigured backends are skipped.
+REFINE_BACKENDS = os.getenv("REFINE_BACKENDS", f"azure:{REFINE_MODEL}")
+# Bump whenever the system prompts or few-shot examples below change; it is
+# part of the refine cache key.
+TEMPLATE_VERSION = "1"
+REFINE_TYPES = ("t2v", "t2i", "i2v", "motion_score")
+
+# Batch refinement
+REFINE_CONCURRENCY = int(os.getenv("REFINE_CONCURRENCY", "8"))
+REFINE_ITEM_TIMEOUT_S = float(os.getenv("REFINE_ITEM_TIMEOUT", "60"))
+RETRY_BACKOFF_BASE_S = 0.5
+RETRY_BACKOFF_CAP_S = 8.0
+
 sys_prompt_t2v = """You are part of a team of bots that creates videos. The workflow is that you first create a caption of the video, and then the assistant bot will generate the video based on the caption. You work with an assistant bot that will draw anything you say.
 
 For example, outputting "a beautiful morning in the woods with the sun peaking through the trees" will trigger your partner bot to output an video of a forest morning, as described. You will be prompted by people looking to create detailed, amazing videos. The way to accomplish this is to take their short prompts and make them extremely detailed and descriptive.
@@ -63,211 +89,284 @@ Output format:
 User input:
 """
 def init_client():
-    return AzureOpenAI(
-        api_key="993b1a85094649778ce83003a5a5ad18",
-        api_version="2024-02-01",
-        azure_endpoint="https://aismwus3.openai.azure.com"
-    )
+    # Pooled, long-lived client owned by the LLM gateway.
+    return get_sync_client("azure")
 
 def image_to_url(image_path):
-    mime_type, _ = guess_type(image_path)
-    if mime_type is None:
-        mime_type = "application/octet-stream"
-    with open(image_path, "rb") as image_file:
-        base64_encoded_data = base64.b64encode(image_file.read()).decode("utf-8")
-    return f"data:{mime_type};base64,{base64_encoded_data}"
-
-def refine_prompt_ollama(prompt, model="deepseek-r1:14b", temperature=0.7):
-    url = "http://localhost:11434/api/generate"
-
-    payload = {
-        "model": model,
-        "prompt": prompt,
-        "stream": False,
-        "options": {
-            "temperature": temperature
-        }
-    }
+    # Downsized, re-encoded and cached by content hash, so retries are free.
+    return image_to_data_url(image_path)
 
+def refine_prompt_ollama(prompt, model=OLLAMA_MODEL, temperature=0.7):
     try:
-        resp = requests.post(url, json=payload, timeout=120)
-        resp.raise_for_status()
-        data = resp.json()
-
-        raw = data.get("response", "").strip()
-
-        # Remove thinking tags and content
-        cleaned = re.sub(r"<thinking>.*?</thinking>", "", raw, flags=re.DOTALL).strip()
-
-        # Also handle cases where reasoning text precedes the final answer
-        # Use heuristic: take the last paragraph
-        if "\n" in cleaned:
-            cleaned = cleaned.split("\n")[-1].strip()
-
-        return cleaned
-
+        return ollama_generate(prompt, model=model, temperature=temperature)
     except Exception as e:
         print("Ollama refine failed:", e)
         return prompt
 
-def refine_prompt(prompt: str, retry_times: int = 3, type: str = "t2v", image_path: str = None):
+def _refine_backends(type: str):
+    backends = parse_backends(REFINE_BACKENDS)
+    if type == "i2v":
+        # Only the Azure deployments take image input.
+        backends = [b for b in backends if b[0] in AZURE_PROVIDERS]
+    return backends
+
+
+def _request_refine(type: str, text: str, image_path: str = None, deadline_s: float = DEADLINE_S):
+    if type == "t2v":
+        return hedged_chat(
+            _refine_backends(type),
+            deadline_s=deadline_s,
+            messages=[
+                {"role": "system", "content": f"{sys_prompt_t2v}"},
+                {
+                    "role": "user",
+                    "content": 'Create an imaginative video descriptive caption or modify an earlier caption for the user input : "A street with parked cars on both sides, lined with commercial buildings featuring Korean signs. The overcast sky suggests early morning or late afternoon."',
+                },
+                {
+                    "role": "assistant",
+                    "content": "A view of a street lined with parked cars on both sides. the buildings flanking the street have various signs and advertisements, some of which are in korean, indicating that this might be a location in south korea. the sky is overcast, suggesting either early morning or late afternoon light. the architecture of the buildings is typical of urban commercial areas, with storefronts on the ground level and possibly offices or residences above.",
+                },
+                {
+                    "role": "user",
+                    "content": 'Create an imaginative video descriptive caption or modify an earlier caption for the user input : "Hands with rings and bracelets wash small greenish-brown seeds in a blue basin under running water, likely outdoors."',
+                },
+                {
+                    "role": "assistant",
+                    "content": "A close-up shot of a person's hands, adorned with rings and bracelets, washing a pile of small, round, greenish-brown seeds in a blue plastic basin. the water is running from an unseen source, likely a tap, and the person is using their hands to agitate the seeds, presumably to clean them. the background is indistinct but appears to be an outdoor setting with natural light.",
+                },
+                {
+                    "role": "user",
+                    "content": 'Create an imaginative video descriptive caption or modify an earlier caption for the user input : "Three men stand near an open black car in a parking lot, with parked vehicles and a partly cloudy sky in the background."',
+                },
+                {
+                    "role": "assistant",
+                    "content": "A scene showing three men in an outdoor setting, likely a parking lot. the man on the left is wearing a light blue shirt and dark shorts, the man in the middle is dressed in a white shirt with a pattern and dark shorts, and the man on the right is wearing a green shirt and jeans. they are standing near a black car with its door open. in the background, there are parked vehicles, including a white truck and a red trailer. the sky is partly cloudy, suggesting it might be a sunny day.",
+                },
+                {
+                    "role": "user",
+                    "content": f'Create an imaginative video descriptive caption or modify an earlier caption in ENGLISH for the user input: " {text} "',
+                },
+            ],
+            model=REFINE_MODEL,
+            temperature=0.01,
+            top_p=0.7,
+            stream=False,
+            max_tokens=250,
+        )
+    elif type == "t2i":
+        return hedged_chat(
+            _refine_backends(type),
+            deadline_s=deadline_s,
+            messages=[
+                {"role": "system", "content": f"{sys_prompt_t2i}"},
+                {
+                    "role": "user",
+                    "content": 'Create an imaginative image descriptive caption or modify an earlier caption for the user input : "a girl on the beach"',
+                },
+                {
+                    "role": "assistant",
+                    "content": "A radiant woman stands on a deserted beach, arms outstretched, wearing a beige trench coat, white blouse, light blue jeans, and chic boots, against a backdrop of soft sky and sea.",
+                },
+                {
+                    "role": "user",
+                    "content": 'Create an imaginative image descriptive caption or modify an earlier caption for the user input : "A man in a blue shirt"',
+                },
+                {
+                    "role": "assistant",
+                    "content": "A determined man in athletic attire, including a blue long-sleeve shirt, black shorts, and blue socks, against a backdrop of a snowy field.",
+                },
+                {
+                    "role": "user",
+                    "content": f'Create an imaginative image descriptive caption or modify an earlier caption in ENGLISH for the user input: " {text} "',
+                },
+            ],
+            model=REFINE_MODEL,
+            temperature=0.01,
+            top_p=0.7,
+            stream=False,
+            max_tokens=250,
+        )
+    elif type == "i2v":
+        return hedged_chat(
+            _refine_backends(type),
+            deadline_s=deadline_s,
+            model=REFINE_MODEL,
+            messages=[
+                {"role": "system", "content": f"{sys_prompt_i2v}"},
+                {
+                    "role": "user",
+                    "content": 'Create an imaginative video descriptive caption or modify an earlier caption for the user input : "A street with parked cars on both sides, lined with commercial buildings featuring Korean signs. The overcast sky suggests early morning or late afternoon."',
+                },
+                {
+                    "role": "assistant",
+                    "content": "A view of a street lined with parked cars on both sides. the buildings flanking the street have various signs and advertisements, some of which are in korean, indicating that this might be a location in south korea. the sky is overcast, suggesting either early morning or late afternoon light. the architecture of the buildings is typical of urban commercial areas, with storefronts on the ground level and possibly offices or residences above.",
+                },
+                {
+                    "role": "user",
+                    "content": 'Create an imaginative video descriptive caption or modify an earlier caption for the user input : "Hands with rings and bracelets wash small greenish-brown seeds in a blue basin under running water, likely outdoors."',
+                },
+                {
+                    "role": "assistant",
+                    "content": "A close-up shot of a person's hands, adorned with rings and bracelets, washing a pile of small, round, greenish-brown seeds in a blue plastic basin. the water is running from an unseen source, likely a tap, and the person is using their hands to agitate the seeds, presumably to clean them. the background is indistinct but appears to be an outdoor setting with natural light.",
+                },
+                {
+                    "role": "user",
+                    "content": 'Create an imaginative video descriptive caption or modify an earlier caption for the user input : "Three men stand near an open black car in a parking lot, with parked vehicles and a partly cloudy sky in the background."',
+                },
+                {
+                    "role": "assistant",
+                    "content": "A scene showing three men in an outdoor setting, likely a parking lot. the man on the left is wearing a light blue shirt and dark shorts, the man in the middle is dressed in a white shirt with a pattern and dark shorts, and the man on the right is wearing a green shirt and jeans. they are standing near a black car with its door open. in the background, there are parked vehicles, including a white truck and a red trailer. the sky is partly cloudy, suggesting it might be a sunny day.",
+                },
+                {
+                    "role": "user",
+                    "content": f'Create an imaginative video descriptive caption or modify an earlier caption in ENGLISH for the user input based on the image: " {text} "',
+                },
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": image_to_url(image_path),
+                            },
+                        },
+                    ],
+                },
+            ],
+            temperature=0.01,
+            top_p=0.7,
+            stream=False,
+            max_tokens=250,
+        )
+    elif type == "motion_score":
+        return hedged_chat(
+            _refine_backends(type),
+            deadline_s=deadline_s,
+            messages=[
+                {"role": "system", "content": f"{sys_prompt_motion_score}"},
+                {
+                    "role": "user",
+                    "content": f"{text}",
+                },
+            ],
+            model=REFINE_MODEL,
+            temperature=0.01,
+            top_p=0.7,
+            stream=False,
+            max_tokens=100,
+        )
+
+
+def refine_prompt(
+    prompt: str,
+    retry_times: int = 3,
+    type: str = "t2v",
+    image_path: str = None,
+    timeout: float = None,
+):
     """
-    Refine a prompt to a format that can be used by the model for inference
+    Refine a prompt to a format that can be used by the model for inference.
+    `timeout` bounds all attempts together; the last error is raised once the
+    retries are used up.
     """
 
-    client = init_client()
     text = prompt.strip()
-    response = None
+    if type == "local-ollama":
+        return refine_prompt_ollama(text)
+    if type not in REFINE_TYPES:
+        return prompt
+
+    local_score = None
+    if type == "motion_score":
+        local_score, confidence = predict_motion_score(text)
+        if should_use_local(confidence):
+            record_local_answer()
+            return format_motion_score(local_score)
+
+    image_hash = image_digest(image_path) if type == "i2v" else None
+    cache_key = make_key(type, text, image_hash, REFINE_BACKENDS, TEMPLATE_VERSION)
+    cached = get_cached(cache_key)
+    if cached is not None:
+        return cached
+
+    deadline = time.monotonic() + (timeout if timeout is not None else DEADLINE_S)
+    last_error = None
     for i in range(retry_times):
-        if type == "t2v":
-            response = client.chat.completions.create(
-                messages=[
-                    {"role": "system", "content": f"{sys_prompt_t2v}"},
-                    {
-                        "role": "user",
-                        "content": 'Create an imaginative video descriptive caption or modify an earlier caption for the user input : "A street with parked cars on both sides, lined with commercial buildings featuring Korean signs. The overcast sky suggests early morning or late afternoon."',
-                    },
-                    {
-                        "role": "assistant",
-                        "content": "A view of a street lined with parked cars on both sides. the buildings flanking the street have various signs and advertisements, some of which are in korean, indicating that this might be a location in south korea. the sky is overcast, suggesting either early morning or late afternoon light. the architecture of the buildings is typical of urban commercial areas, with storefronts on the ground level and possibly offices or residences above.",
-                    },
-                    {
-                        "role": "user",
-                        "content": 'Create an imaginative video descriptive caption or modify an earlier caption for the user input : "Hands with rings and bracelets wash small greenish-brown seeds in a blue basin under running water, likely outdoors."',
-                    },
-                    {
-                        "role": "assistant",
-                        "content": "A close-up shot of a person's hands, adorned with rings and bracelets, washing a pile of small, round, greenish-brown seeds in a blue plastic basin. the water is running from an unseen source, likely a tap, and the person is using their hands to agitate the seeds, presumably to clean them. the background is indistinct but appears to be an outdoor setting with natural light.",
-                    },
-                    {
-                        "role": "user",
-                        "content": 'Create an imaginative video descriptive caption or modify an earlier caption for the user input : "Three men stand near an open black car in a parking lot, with parked vehicles and a partly cloudy sky in the background."',
-                    },
-                    {
-                        "role": "assistant",
-                        "content": "A scene showing three men in an outdoor setting, likely a parking lot. the man on the left is wearing a light blue shirt and dark shorts, the man in the middle is dressed in a white shirt with a pattern and dark shorts, and the man on the right is wearing a green shirt and jeans. they are standing near a black car with its door open. in the background, there are parked vehicles, including a white truck and a red trailer. the sky is partly cloudy, suggesting it might be a sunny day.",
-                    },
-                    {
-                        "role": "user",
-                        "content": f'Create an imaginative video descriptive caption or modify an earlier caption in ENGLISH for the user input: " {text} "',
-                    },
-                ],
-                model="gpt4o",  # glm-4-plus and gpt4o have be tested
-                temperature=0.01,
-                top_p=0.7,
-                stream=False,
-                max_tokens=250,
-            )
-        elif type == "t2i":
-            response = client.chat.completions.create(
-                messages=[
-                    {"role": "system", "content": f"{sys_prompt_t2i}"},
-                    {
-                        "role": "user",
-                        "content": 'Create an imaginative image descriptive caption or modify an earlier caption for the user input : "a girl on the beach"',
-                    },
-                    {
-                        "role": "assistant",
-                        "content": "A radiant woman stands on a deserted beach, arms outstretched, wearing a beige trench coat, white blouse, light blue jeans, and chic boots, against a backdrop of soft sky and sea.",
-                    },
-                    {
-                        "role": "user",
-                        "content": 'Create an imaginative image descriptive caption or modify an earlier caption for the user input : "A man in a blue shirt"',
-                    },
-                    {
-                        "role": "assistant",
-                        "content": "A determined man in athletic attire, including a blue long-sleeve shirt, black shorts, and blue socks, against a backdrop of a snowy field.",
-                    },
-                    {
-                        "role": "user",
-                        "content": f'Create an imaginative image descriptive caption or modify an earlier caption in ENGLISH for the user input: " {text} "',
-                    },
-                ],
-                model="gpt4o",  # glm-4-plus and gpt4o have be tested
-                temperature=0.01,
-                top_p=0.7,
-                stream=False,
-                max_tokens=250,
-            )
-        elif type == "i2v":
-            response = client.chat.completions.create(
-                model="gpt4o",
-                messages=[
-                    {"role": "system", "content": f"{sys_prompt_i2v}"},
-                    {
-                        "role": "user",
-                        "content": 'Create an imaginative video descriptive caption or modify an earlier caption for the user input : "A street with parked cars on both sides, lined with commercial buildings featuring Korean signs. The overcast sky suggests early morning or late afternoon."',
-                    },
-                    {
-                        "role": "assistant",
-                        "content": "A view of a street lined with parked cars on both sides. the buildings flanking the street have various signs and advertisements, some of which are in korean, indicating that this might be a location in south korea. the sky is overcast, suggesting either early morning or late afternoon light. the architecture of the buildings is typical of urban commercial areas, with storefronts on the ground level and possibly offices or residences above.",
-                    },
-                    {
-                        "role": "user",
-                        "content": 'Create an imaginative video descriptive caption or modify an earlier caption for the user input : "Hands with rings and bracelets wash small greenish-brown seeds in a blue basin under running water, likely outdoors."',
-                    },
-                    {
-                        "role": "assistant",
-                        "content": "A close-up shot of a person's hands, adorned with rings and bracelets, washing a pile of small, round, greenish-brown seeds in a blue plastic basin. the water is running from an unseen source, likely a tap, and the person is using their hands to agitate the seeds, presumably to clean them. the background is indistinct but appears to be an outdoor setting with natural light.",
-                    },
-                    {
-                        "role": "user",
-                        "content": 'Create an imaginative video descriptive caption or modify an earlier caption for the user input : "Three men stand near an open black car in a parking lot, with parked vehicles and a partly cloudy sky in the background."',
-                    },
-                    {
-                        "role": "assistant",
-                        "content": "A scene showing three men in an outdoor setting, likely a parking lot. the man on the left is wearing a light blue shirt and dark shorts, the man in the middle is dressed in a white shirt with a pattern and dark shorts, and the man on the right is wearing a green shirt and jeans. they are standing near a black car with its door open. in the background, there are parked vehicles, including a white truck and a red trailer. the sky is partly cloudy, suggesting it might be a sunny day.",
-                    },
-                    {
-                        "role": "user",
-                        "content": f'Create an imaginative video descriptive caption or modify an earlier caption in ENGLISH for the user input based on the image: " {text} "',
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": image_to_url(image_path),
-                                },
-                            },
-                        ],
-                    },
-                ],
-                temperature=0.01,
-                top_p=0.7,
-                stream=False,
-                max_tokens=250,
-            )
-        elif type == "motion_score":
-            response = client.chat.completions.create(
-                messages=[
-                    {"role": "system", "content": f"{sys_prompt_motion_score}"},
-                    {
-                        "role": "user",
-                        "content": f"{text}",
-                    },
-                ],
-                model="gpt4o",  # glm-4-plus and gpt4o have be tested
-                temperature=0.01,
-                top_p=0.7,
-                stream=False,
-                max_tokens=100,
-            )
-        elif type == "local-ollama":
-            return refine_prompt_ollama(text)
-        if response is None:
-            continue
-        if response.choices:
-            return response.choices[0].message.content
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            started = time.perf_counter()
+            response = _request_refine(type, text, image_path, deadline_s=remaining)
+            content = strip_reasoning(response.choices[0].message.content or "") if response.choices else ""
+            if content:
+                put_cached(cache_key, content)
+                if type == "motion_score":
+                    record_llm_score(text, content, (time.perf_counter() - started) * 1000.0, local_score)
+                return content
+        except Exception as e:
+            last_error = e
+        if i + 1 < retry_times:
+            time.sleep(min(_retry_delay(i), max(deadline - time.monotonic(), 0.0)))
+    if last_error is not None:
+        raise last_error
     return prompt
 
 
-def refine_prompts(prompts: list[str], retry_times: int = 3, type: str = "t2v", image_paths: list[str] = None):
+def _retry_delay(attempt: int) -> float:
+    # Full jitter, same shape as the LLM gateway.
+    return random.uniform(0.0, min(RETRY_BACKOFF_CAP_S, RETRY_BACKOFF_BASE_S * (2 ** attempt)))
+
+
+def refine_prompts(
+    prompts: list[str],
+    retry_times: int = 3,
+    type: str = "t2v",
+    image_paths: list[str] = None,
+    max_workers: int = REFINE_CONCURRENCY,
+    item_timeout: float = REFINE_ITEM_TIMEOUT_S,
+    return_errors: bool = False,
+):
+    """
+    Refine prompts concurrently, keeping input order. An item that fails or
+    runs past `item_timeout` falls back to its original prompt; with
+    return_errors=True the failures are returned as well, as
+    [{"index", "prompt", "error"}].
+    """
     if image_paths is None:
         image_paths = [None] * len(prompts)
-    refined_prompts = []
-    for prompt, image_path in zip(prompts, image_paths):
-        refined_prompt = refine_prompt(prompt, retry_times=retry_times, type=type, image_path=image_path)
-        refined_prompts.append(refined_prompt)
+    items = list(zip(prompts, image_paths))
+    refined_prompts = list(prompts)
+    errors = []
+
+    def _job(item):
+        prompt, image_path = item
+        return refine_prompt(prompt, retry_times=retry_times, type=type, image_path=image_path, timeout=item_timeout)
+
+    if len(items) <= 1 or max_workers <= 1:
+        outcomes = []
+        for item in items:
+            try:
+                outcomes.append((_job(item), None))
+            except Exception as e:
+                outcomes.append((None, e))
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as pool:
+            futures = [pool.submit(_job, item) for item in items]
+            outcomes = []
+            for future in futures:
+                try:
+                    outcomes.append((future.result(), None))
+                except Exception as e:
+                    outcomes.append((None, e))
+
+    for i, (result, error) in enumerate(outcomes):
+        if error is None:
+            refined_prompts[i] = result
+        else:
+            print(f"⚠️ refine failed for item {i}: {error}")
+            errors.append({"index": i, "prompt": prompts[i], "error": str(error) or error.__class__.__name__})
+
+    if return_errors:
+        return refined_prompts, errors
     return refined_prompts
@@ -0,0 +1,81 @@
+# Minimal stand-in for Ollama's streaming /api/generate, used by
+# tests/test_ollama.py. Can also be run by hand:
+#   OLLAMA_STUB_PORT=11434 python tests/ollama_stub.py
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_PORT = int(os.getenv("OLLAMA_STUB_PORT", "11434"))
+# Delay between streamed chunks, to make early stream closing observable.
+STUB_CHUNK_DELAY_S = float(os.getenv("OLLAMA_STUB_CHUNK_DELAY", "0.02"))
+
+ANSWER_SUFFIX = ", cinematic lighting, smooth camera motion"
+_TRAILER = "\n\nNotes: this paragraph is never needed and should not be generated."
+
+
+def stream_text(prompt: str, tag: str = "think") -> str:
+    reasoning = f"<{tag}>\nThe user wants a richer caption. Keep the subject, add motion.\n</{tag}>\n\n" if tag else ""
+    return reasoning + prompt.strip() + ANSWER_SUFFIX + _TRAILER
+
+
+def _chunks(text: str):
+    # Small uneven chunks so tags arrive split across lines.
+    i = 0
+    while i < len(text):
+        step = 3 + i % 5
+        yield text[i:i + step]
+        i += step
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, tag: str = "think"):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.tag = tag
+        # Per finished request: {"chunks": sent, "total": available, "closed_early": bool}
+        self.streams = []
+        self.stream_done = threading.Event()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path != "/api/generate":
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        model = body.get("model", "stub")
+        chunks = list(_chunks(stream_text(body.get("prompt", ""), self.server.tag)))
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        sent, closed_early = 0, False
+        try:
+            for chunk in chunks:
+                self.wfile.write((json.dumps({"model": model, "response": chunk, "done": False}) + "\n").encode("utf-8"))
+                self.wfile.flush()
+                sent += 1
+                time.sleep(STUB_CHUNK_DELAY_S)
+            self.wfile.write((json.dumps({"model": model, "response": "", "done": True}) + "\n").encode("utf-8"))
+        except (BrokenPipeError, ConnectionResetError):
+            closed_early = True
+        self.server.streams.append({"chunks": sent, "total": len(chunks), "closed_early": closed_early})
+        self.server.stream_done.set()
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    server = StubServer(STUB_PORT)
+    print(f"🧪 Ollama stub listening on {server.url}/api/generate")
+    server.serve_forever()
@@ -0,0 +1,56 @@
+import threading
+
+import pytest
+
+ollama = pytest.importorskip("app.services.ollama")
+
+from ollama_stub import ANSWER_SUFFIX, StubServer  # noqa: E402
+
+PROMPT = "a cat walking"
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    servers = []
+
+    def start(tag="think"):
+        server = StubServer(tag=tag)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        monkeypatch.setattr(ollama, "OLLAMA_URL", server.url)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize("tag", ["think", "thinking"])
+def test_generate_strips_reasoning_and_closes_stream_early(stub, tag):
+    server = stub(tag)
+    assert ollama.generate(PROMPT) == PROMPT + ANSWER_SUFFIX
+
+    # Closing the response stops the server mid-stream; the broken pipe only
+    # shows up on the server's next write.
+    assert server.stream_done.wait(5)
+    stream = server.streams[0]
+    assert stream["closed_early"]
+    assert stream["chunks"] < stream["total"]
+
+
+def test_generate_without_reasoning_reads_to_done(stub):
+    server = stub(tag="")
+    # No reasoning block: the last line of the full answer is returned.
+    assert ollama.generate(PROMPT) == "Notes: this paragraph is never needed and should not be generated."
+    assert server.stream_done.wait(5)
+    assert not server.streams[0]["closed_early"]
+
+
+def test_stripper_handles_tags_split_across_chunks():
+    stripper = ollama.ReasoningStripper()
+    for chunk in ["<th", "ink>plan", " more</t", "hink>\n\nanswer", " text\n\nrest"]:
+        stripper.feed(chunk)
+    assert stripper.saw_reasoning
+    assert stripper.answer_complete()
+    assert ollama._final_answer(stripper.answer, stripper.saw_reasoning) == "answer text"
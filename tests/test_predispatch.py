@@ -0,0 +1,103 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+predispatch = pytest.importorskip("app.services.predispatch")
+
+PARAMS = {
+    "prompt": "a man running fast",
+    "config": "configs/diffusion/inference/256px.py",
+    "steps": 40,
+    "frames": 112,
+    "ratio": "9:16",
+    "fps": 16,
+    "motion_score": "auto",
+    "optimize_prompt": True,
+}
+
+
+class FakeWS:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+
+def _slow(value):
+    def fn(prompt):
+        time.sleep(0.2)
+        return value(prompt)
+    return fn
+
+
+def test_finish_enrichment_applies_finished_stages(monkeypatch):
+    monkeypatch.setattr(predispatch, "_refine_caption", lambda p: f"refined {p}")
+    monkeypatch.setattr(predispatch, "_score_motion", lambda p: 9)
+
+    async def run():
+        state = predispatch.start_enrichment(PARAMS)
+        await predispatch.wait_enrichment(state, 5)
+        return await predispatch.finish_enrichment(state, PARAMS, 0.0)
+
+    params, report = asyncio.run(run())
+    assert params["prompt"] == "refined a man running fast"
+    assert params["motion_score"] == 9
+    assert {s["status"] for s in report["stages"].values()} == {"applied"}
+
+
+def test_skipped_motion_stage_falls_back_to_default(monkeypatch):
+    monkeypatch.setattr(predispatch, "_score_motion", _slow(lambda p: 9))
+    monkeypatch.setattr(predispatch, "predict_motion_score", lambda p: (12, 0.1))
+
+    async def run():
+        state = predispatch.start_enrichment({**PARAMS, "optimize_prompt": False})
+        return await predispatch.finish_enrichment(state, PARAMS, 0.0)
+
+    params, report = asyncio.run(run())
+    assert report["stages"]["motion_score"]["status"] == "skipped"
+    assert params["motion_score"] == predispatch.DEFAULT_MOTION_SCORE
+
+
+def test_idle_gpu_waits_for_enrichment_before_dispatch(monkeypatch):
+    infra = pytest.importorskip("app.api.infra_routes")
+    from app.services.gpu_pool import parse_capabilities, register_worker, remove_worker
+
+    monkeypatch.setattr(predispatch, "_refine_caption", _slow(lambda p: f"refined {p}"))
+    monkeypatch.setattr(predispatch, "_score_motion", _slow(lambda p: 9))
+
+    async def run():
+        gpu_ws, front_ws = FakeWS(), FakeWS()
+        caps = parse_capabilities({})
+        infra.gpu_registry["gpu-test"] = {
+            "ws": gpu_ws,
+            "status": "idle",
+            "last_heartbeat": time.time(),
+            "current_task": None,
+            "caps": caps,
+        }
+        register_worker("gpu-test", caps)
+        try:
+            params = dict(PARAMS)
+            data = {"type": "TASK_EXECUTION", "parameters": params}
+            await infra.enqueue_task(front_ws, data, "user-1", "task-1", params)
+            # The GPU is idle, but the task must not take it before enrichment lands.
+            assert gpu_ws.sent == []
+            for _ in range(100):
+                if gpu_ws.sent:
+                    break
+                await asyncio.sleep(0.02)
+            return gpu_ws.sent
+        finally:
+            infra.gpu_registry.pop("gpu-test", None)
+            remove_worker("gpu-test")
+            for m in (infra.task_ctx_map, infra.task_frontend_map, infra.task_gpu_map):
+                m.pop("task-1", None)
+
+    sent = asyncio.run(run())
+    assert sent, "task was never dispatched"
+    command = sent[0]["command"]
+    assert '--prompt "refined a man running fast"' in command
+    assert "--motion_score 9" in command
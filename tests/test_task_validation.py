@@ -0,0 +1,28 @@
+import pytest
+
+infra = pytest.importorskip("app.api.infra_routes")
+
+PARAMS = {
+    "prompt": "a cat",
+    "config": "configs/diffusion/inference/256px.py",
+    "steps": 40,
+    "frames": 49,
+    "ratio": "9:16",
+    "fps": 16,
+    "motion_score": "auto",
+}
+
+
+def test_valid_parameters_pass():
+    assert infra.validate_task_parameters(PARAMS, "t") is None
+
+
+@pytest.mark.parametrize("field,value", [("frames", "49f"), ("min_vram_gb", "lots"), ("frames", None)])
+def test_bad_gpu_requirements_are_rejected(field, value):
+    error = infra.validate_task_parameters({**PARAMS, field: value}, "t")
+    assert error and error.startswith(("Invalid task parameters", "Missing task parameter"))
+
+
+def test_missing_parameter_is_rejected():
+    params = {k: v for k, v in PARAMS.items() if k != "config"}
+    assert infra.validate_task_parameters(params, "t") == "Missing task parameter: config"